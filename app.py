@@ -3,6 +3,7 @@ import pandas as pd
 import uuid
 import urllib.parse
 from datetime import datetime
+from concurrent.futures import wait, FIRST_COMPLETED
 
 # Import des fonctions et constantes depuis utils.py
 # (Assurez-vous que utils.py est dans le même répertoire)
@@ -101,433 +102,525 @@ init_session_state()
 
 # --- FLUX PRINCIPAL ---
 
-st.markdown('<div class="main-header"><h1>📝Formulaire Chantier </h1></div>', unsafe_allow_html=True)
+# Chaque rerun est mesuré (durée totale et par étape) lorsque l'instrumentation est activée
+with utils.rerun_span(st.session_state['step']):
+    st.markdown('<div class="main-header"><h1>📝Formulaire Chantier </h1></div>', unsafe_allow_html=True)
 
-# 1. CHARGEMENT
-if st.session_state['step'] == 'PROJECT_LOAD':
-    st.info("Tentative de chargement de la structure des formulaires...")
-    with st.spinner("Chargement en cours..."):
-        df_struct = utils.load_form_structure_from_firestore()
-        utils.load_site_data_from_firestore.clear() 
-        df_site = utils.load_site_data_from_firestore()
+    # Budget mémoire de la session : évince les exports puis décharge les photos sur disque si nécessaire
+    memory_state = utils.enforce_memory_budget(st.session_state)
+    if memory_state['warning']:
+        used_mb = memory_state['usage']['total'] / (1024 * 1024)
+        limit_mb = memory_state['limit'] / (1024 * 1024)
+        st.warning(
+            f"⚠️ Cet audit occupe **{used_mb:.0f} Mo** sur {limit_mb:.0f} Mo autorisés. "
+            "Les photos des phases validées peuvent être déplacées sur disque ; pensez à terminer l'audit rapidement.",
+            icon="💾"
+        )
+
+    # 1. CHARGEMENT
+    if st.session_state['step'] == 'PROJECT_LOAD':
+        st.info("Tentative de chargement de la structure des formulaires...")
+        with st.spinner("Chargement en cours..."):
+            df_struct = utils.load_form_structure_from_firestore()
+            df_site = utils.load_site_data_from_firestore()
         
-        if df_struct is not None and df_site is not None:
-            st.session_state['df_struct'] = df_struct
-            st.session_state['df_site'] = df_site
-            st.session_state['step'] = 'PROJECT'
-            st.rerun()
-        else:
-            st.error("Impossible de charger les données. Vérifiez votre connexion et les secrets Firebase.")
-            if st.button("Réessayer le chargement"):
-                utils.load_form_structure_from_firestore.clear() 
-                utils.load_site_data_from_firestore.clear() 
-                st.session_state['step'] = 'PROJECT_LOAD'
+            if df_struct is not None and df_site is not None:
+                st.session_state['df_struct'] = df_struct
+                st.session_state['df_site'] = df_site
+                st.session_state['step'] = 'PROJECT'
                 st.rerun()
+            else:
+                st.error("Impossible de charger les données. Vérifiez votre connexion et les secrets Firebase.")
+                if st.button("Réessayer le chargement"):
+                    utils.load_form_structure_from_firestore.clear() 
+                    utils.load_site_data_from_firestore.clear() 
+                    st.session_state['step'] = 'PROJECT_LOAD'
+                    st.rerun()
 
-# 2. SELECTION PROJET
-elif st.session_state['step'] == 'PROJECT':
-    df_site = st.session_state['df_site']
-    st.markdown("### 🏗️ Sélection du Chantier")
+    # 2. SELECTION PROJET
+    elif st.session_state['step'] == 'PROJECT':
+        df_site = st.session_state['df_site']
+        st.markdown("### 🏗️ Sélection du Chantier")
     
-    if 'Intitulé' not in df_site.columns:
-        st.error("Colonne 'Intitulé' manquante dans les données 'Sites'.")
-    else:
-        search_term = st.text_input("Rechercher un projet (Veuillez renseigner au minimum 3 caractères pour le nom de la ville)", key="project_search_input").strip()
-        filtered_projects = []
-        selected_proj = None
+        if 'Intitulé' not in df_site.columns:
+            st.error("Colonne 'Intitulé' manquante dans les données 'Sites'.")
+        else:
+            search_term = st.text_input("Rechercher un projet (Veuillez renseigner au minimum 3 caractères pour le nom de la ville)", key="project_search_input").strip()
+            filtered_projects = []
+            selected_proj = None
         
-        if len(search_term) >= 3:
-            mask = df_site['Intitulé'].str.contains(search_term, case=False, na=False)
-            filtered_projects_df = df_site[mask]
-            filtered_projects = [""] + filtered_projects_df['Intitulé'].dropna().unique().tolist()
-            if filtered_projects:
-                selected_proj = st.selectbox("Résultats de la recherche", filtered_projects)
-            else:
-                st.warning(f"Aucun projet trouvé pour **'{search_term}'**.")
-        elif len(search_term) > 0 and len(search_term) < 3:
-            st.info("Veuillez entrer au moins **3 caractères** pour lancer la recherche.")
+            if len(search_term) >= 3:
+                mask = df_site['Intitulé'].str.contains(search_term, case=False, na=False)
+                filtered_projects_df = df_site[mask]
+                filtered_projects = [""] + filtered_projects_df['Intitulé'].dropna().unique().tolist()
+                if filtered_projects:
+                    selected_proj = st.selectbox("Résultats de la recherche", filtered_projects)
+                else:
+                    st.warning(f"Aucun projet trouvé pour **'{search_term}'**.")
+            elif len(search_term) > 0 and len(search_term) < 3:
+                st.info("Veuillez entrer au moins **3 caractères** pour lancer la recherche.")
         
-        if selected_proj:
-            row = df_site[df_site['Intitulé'] == selected_proj].iloc[0]
-            st.info(f"Projet sélectionné : **{selected_proj}**")
-            if st.button("✅ Démarrer l'identification"):
-                st.session_state['project_data'] = row.to_dict()
-                st.session_state['form_start_time'] = datetime.now() 
-                st.session_state['submission_id'] = str(uuid.uuid4())
-                st.session_state['step'] = 'IDENTIFICATION'
-                st.session_state['current_phase_temp'] = {}
-                st.session_state['iteration_id'] = str(uuid.uuid4())
-                st.session_state['show_comment_on_error'] = False
-                st.session_state['last_validation_errors'] = None
-                st.rerun()
+            if selected_proj:
+                row = df_site[df_site['Intitulé'] == selected_proj].iloc[0]
+                st.info(f"Projet sélectionné : **{selected_proj}**")
 
-# 3. IDENTIFICATION
-elif st.session_state['step'] == 'IDENTIFICATION':
-    df = st.session_state['df_struct']
-    ID_SECTION_NAME = df['section'].iloc[0]
-    st.markdown(f"### 👤 Étape unique : {ID_SECTION_NAME}")
+                # Statistiques agrégées du projet (une seule lecture Firestore)
+                proj_stats = utils.load_submission_stats(project_name=selected_proj)
+                if proj_stats:
+                    with st.expander("📊 Historique des audits du projet", expanded=False):
+                        mean_duration = proj_stats.get('mean_duration_seconds')
+                        c1, c2, c3 = st.columns(3)
+                        with c1: st.metric("Audits réalisés", proj_stats.get('audit_count', 0))
+                        with c2: st.metric("Durée moyenne", f"{mean_duration / 60:.0f} min" if mean_duration else "N/A")
+                        with c3: st.metric("Justifications photo", proj_stats.get('comment_required_count', 0))
+                        section_rows = [
+                            {
+                                'Section': name,
+                                'Phases': sec.get('phase_count', 0),
+                                'Photos': sec.get('photo_count', 0),
+                                'Écarts photo': sec.get('photo_gap_count', 0),
+                                'Justifications': sec.get('comment_required_count', 0),
+                            }
+                            for name, sec in proj_stats.get('sections', {}).items()
+                        ]
+                        if section_rows: st.dataframe(pd.DataFrame(section_rows), hide_index=True, use_container_width=True)
+                if st.button("✅ Démarrer l'identification"):
+                    st.session_state['project_data'] = row.to_dict()
+                    st.session_state['form_start_time'] = datetime.now() 
+                    st.session_state['submission_id'] = str(uuid.uuid4())
+                    st.session_state['step'] = 'IDENTIFICATION'
+                    st.session_state['current_phase_temp'] = {}
+                    st.session_state['iteration_id'] = str(uuid.uuid4())
+                    st.session_state['show_comment_on_error'] = False
+                    st.session_state['last_validation_errors'] = None
+                    st.rerun()
+
+    # 3. IDENTIFICATION
+    elif st.session_state['step'] == 'IDENTIFICATION':
+        df = st.session_state['df_struct']
+        ID_SECTION_NAME = df['section'].iloc[0]
+        st.markdown(f"### 👤 Étape unique : {ID_SECTION_NAME}")
     
-    identification_questions = df[df['section'] == ID_SECTION_NAME].copy()
+        identification_questions = df[df['section'] == ID_SECTION_NAME].copy()
     
-    # 1. Assurer que l'ID est numérique
-    identification_questions['id_temp'] = pd.to_numeric(identification_questions['id'], errors='coerce').fillna(0)
+        # 1. Assurer que l'ID est numérique
+        identification_questions['id_temp'] = pd.to_numeric(identification_questions['id'], errors='coerce').fillna(0)
     
-    # 2. Trier par ID numérique croissant pour la logique conditionnelle
-    identification_questions = identification_questions.sort_values(by='id_temp')
+        # 2. Trier par ID numérique croissant pour la logique conditionnelle
+        identification_questions = identification_questions.sort_values(by='id_temp')
 
-    if st.session_state['id_rendering_ident'] is None: st.session_state['id_rendering_ident'] = str(uuid.uuid4())
-    rendering_id = st.session_state['id_rendering_ident']
+        if st.session_state['id_rendering_ident'] is None: st.session_state['id_rendering_ident'] = str(uuid.uuid4())
+        rendering_id = st.session_state['id_rendering_ident']
     
-    for idx, (index, row) in enumerate(identification_questions.iterrows()):
-        if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
-            utils.render_question(row, st.session_state['current_phase_temp'], ID_SECTION_NAME, rendering_id, idx, st.session_state['project_data'])
+        for idx, (index, row) in enumerate(identification_questions.iterrows()):
+            if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
+                utils.render_question(row, st.session_state['current_phase_temp'], ID_SECTION_NAME, rendering_id, idx, st.session_state['project_data'])
             
 
-    # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (IDENTIFICATION) ---
-    if st.session_state['last_validation_errors']:
-        st.markdown(
-            f'<div class="error-box"><b>⚠️ Erreur de validation :</b><br>Les questions suivantes nécessitent une réponse ou une correction :<br>{st.session_state["last_validation_errors"]}</div>', 
-            unsafe_allow_html=True
-        )
-    # ------------------------------------------------------------------------
+        # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (IDENTIFICATION) ---
+        if st.session_state['last_validation_errors']:
+            st.markdown(
+                f'<div class="error-box"><b>⚠️ Erreur de validation :</b><br>Les questions suivantes nécessitent une réponse ou une correction :<br>{st.session_state["last_validation_errors"]}</div>', 
+                unsafe_allow_html=True
+            )
+        # ------------------------------------------------------------------------
 
-    st.markdown("---")
-    if st.button("✅ Valider l'identification"):
-        st.session_state['last_validation_errors'] = None # Réinitialisation à la tentative de validation
-        
-        # --- CORRECTION ROBUSTESSE IDENTIFICATION (Vérification df_struct) ---
-        df_struct = st.session_state.get('df_struct')
-        if df_struct is None:
-            st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
-            st.rerun() # <--- CORRECTION ICI
-        # --------------------------------------------------------------------
-        
-        # NOTE: On n'utilise pas le try/except ici pour ne pas masquer d'erreur dans l'étape initiale
-        is_valid, errors = utils.validate_section(df_struct, ID_SECTION_NAME, st.session_state['current_phase_temp'], st.session_state['collected_data'], st.session_state['project_data'])
+        st.markdown("---")
+        if st.button("✅ Valider l'identification"):
+            st.session_state['last_validation_errors'] = None # Réinitialisation à la tentative de validation
         
-        if is_valid:
-            id_entry = {"phase_name": ID_SECTION_NAME, "answers": st.session_state['current_phase_temp'].copy()}
-            st.session_state['collected_data'].append(id_entry)
-            st.session_state['identification_completed'] = True
-            st.session_state['step'] = 'LOOP_DECISION'
-            st.session_state['current_phase_temp'] = {}
-            st.session_state['show_comment_on_error'] = False
-            st.session_state['last_validation_errors'] = None 
-            st.success("Identification validée.")
-            st.rerun()
-        else:
-            # --- CORRECTION ROBUSTESSE D'ERREUR V2 ---
-            cleaned_errors = [str(e) for e in errors if e is not None]
-
-            html_errors = '<br>'.join([f"- {e}" for e in cleaned_errors])
-            st.session_state['last_validation_errors'] = html_errors
-            st.rerun() # <--- CORRECTION ICI
-            # -----------------------------------------
-
-# 4. BOUCLE PHASES
-elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
-    project_intitule = st.session_state['project_data'].get('Intitulé', 'Projet Inconnu')
-    with st.expander(f"📍 Projet : {project_intitule}", expanded=False):
-        project_details = st.session_state['project_data']
-        st.markdown(":orange-badge[**Détails du Projet sélectionné :**]")
+            # --- CORRECTION ROBUSTESSE IDENTIFICATION (Vérification df_struct) ---
+            df_struct = st.session_state.get('df_struct')
+            if df_struct is None:
+                st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
+                st.rerun() # <--- CORRECTION ICI
+            # --------------------------------------------------------------------
         
-        # Affichage des détails du projet (récupéré des données 'Sites')
-        with st.container(border=True):
-            st.markdown("**Informations générales**")
-            cols1 = st.columns([1, 1, 1]) 
-            fields_l1 = utils.DISPLAY_GROUPS[0]
-            for i, field_key in enumerate(fields_l1):
-                renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
-                value = project_details.get(field_key, 'N/A')
-                with cols1[i]: st.markdown(f"**{renamed_key}** : {value}")
-                    
-        with st.container(border=True):
-            st.markdown("**Points de charge Standard**")
-            cols2 = st.columns([1, 1, 1])
-            fields_l2 = utils.DISPLAY_GROUPS[1]
-            for i, field_key in enumerate(fields_l2):
-                renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
-                value = project_details.get(field_key, 'N/A')
-                with cols2[i]: st.markdown(f"**{renamed_key}** : {value}")
-
-        with st.container(border=True):
-            st.markdown("**Points de charge Pré-équipés**")
-            cols3 = st.columns([1, 1, 1])
-            fields_l3 = utils.DISPLAY_GROUPS[2]
-            for i, field_key in enumerate(fields_l3):
-                renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
-                value = project_details.get(field_key, 'N/A')
-                with cols3[i]: st.markdown(f"**{renamed_key}** : {value}")
+            # NOTE: On n'utilise pas le try/except ici pour ne pas masquer d'erreur dans l'étape initiale
+            is_valid, errors = utils.validate_section(df_struct, ID_SECTION_NAME, st.session_state['current_phase_temp'], st.session_state['collected_data'], st.session_state['project_data'])
         
-        st.write(":orange-badge[**Phases et Identification déjà complétées :**]")
-        for idx, item in enumerate(st.session_state['collected_data']):
-            st.write(f"• **{item['phase_name']}** : {len(item['answers'])} réponses")
-
-    if st.session_state['step'] == 'LOOP_DECISION':
-        st.markdown("### 🔄 Gestion des Phases")
-        col1, col2 = st.columns(2)
-        with col1:
-            if st.button("➕ Ajouter une phase"):
-                st.session_state['step'] = 'FILL_PHASE'
+            if is_valid:
+                id_entry = {
+                    "phase_name": ID_SECTION_NAME,
+                    "answers": st.session_state['current_phase_temp'].copy(),
+                    "photo_check": utils.phase_photo_check(df_struct, ID_SECTION_NAME, st.session_state['current_phase_temp'], st.session_state['collected_data'], st.session_state['project_data']),
+                }
+                st.session_state['collected_data'].append(id_entry)
+                st.session_state['identification_completed'] = True
+                st.session_state['step'] = 'LOOP_DECISION'
                 st.session_state['current_phase_temp'] = {}
-                st.session_state['current_phase_name'] = None
-                st.session_state['iteration_id'] = str(uuid.uuid4())
                 st.session_state['show_comment_on_error'] = False
-                st.session_state['last_validation_errors'] = None
-                st.rerun()
-        with col2:
-            if st.button("🏁 Terminer l'audit"):
-                st.session_state['step'] = 'FINISHED'
+                st.session_state['last_validation_errors'] = None 
+                st.success("Identification validée.")
                 st.rerun()
-        st.markdown('</div>', unsafe_allow_html=True)
+            else:
+                # --- CORRECTION ROBUSTESSE D'ERREUR V2 ---
+                cleaned_errors = [str(e) for e in errors if e is not None]
 
-    elif st.session_state['step'] == 'FILL_PHASE':
-        df = st.session_state['df_struct']
-        ID_SECTION_NAME = df['section'].iloc[0]
-        ID_SECTION_CLEAN = str(ID_SECTION_NAME).strip().lower()
-        # Exclure la section d'identification et la ligne de question 'phase' si elle existe
-        SECTIONS_TO_EXCLUDE_CLEAN = {ID_SECTION_CLEAN, "phase"} 
-        all_sections_raw = df['section'].unique().tolist()
-        available_phases = []
-        for sec in all_sections_raw:
-            if pd.isna(sec) or not sec or str(sec).strip().lower() in SECTIONS_TO_EXCLUDE_CLEAN: continue
-            available_phases.append(sec)
-        
-        if not st.session_state['current_phase_name']:
-              st.markdown("### 📑 Sélection de la phase")
-              phase_choice = st.selectbox("Quelle phase ?", [""] + available_phases)
-              if phase_choice:
-                  st.session_state['current_phase_name'] = phase_choice
-                  st.session_state['show_comment_on_error'] = False 
-                  st.session_state['last_validation_errors'] = None
-                  st.rerun()
-              if st.button("⬅️ Retour"):
-                  st.session_state['step'] = 'LOOP_DECISION'
-                  st.session_state['current_phase_temp'] = {}
-                  st.session_state['show_comment_on_error'] = False
-                  st.session_state['last_validation_errors'] = None
-                  st.rerun()
-        else:
-            current_phase = st.session_state['current_phase_name']
-            st.markdown(f"### 📝 {current_phase}")
-            if st.button("🔄 Changer de phase"):
-                st.session_state['current_phase_name'] = None
-                st.session_state['current_phase_temp'] = {}
-                st.session_state['iteration_id'] = str(uuid.uuid4())
-                st.session_state['show_comment_on_error'] = False
-                st.session_state['last_validation_errors'] = None
-                st.rerun()
-            st.divider()
-            
-            section_questions = df[df['section'] == current_phase].copy()
-            section_questions['id_temp'] = pd.to_numeric(section_questions['id'], errors='coerce').fillna(0)
-            section_questions = section_questions.sort_values(by='id_temp')
+                html_errors = '<br>'.join([f"- {e}" for e in cleaned_errors])
+                st.session_state['last_validation_errors'] = html_errors
+                st.rerun() # <--- CORRECTION ICI
+                # -----------------------------------------
 
-            visible_count = 0
-            for idx, (index, row) in enumerate(section_questions.iterrows()):
-                if int(row.get('id', 0)) == utils.COMMENT_ID: continue
-                
-                if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
-                    utils.render_question(row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], idx, st.session_state['project_data'])
-                    visible_count += 1
-            
-            if visible_count == 0 and not st.session_state.get('show_comment_on_error', False):
-                st.warning("Aucune question visible dans cette phase.")
+    # 4. BOUCLE PHASES
+    elif st.session_state['step'] in ['LOOP_DECISION', 'FILL_PHASE']:
+        project_intitule = st.session_state['project_data'].get('Intitulé', 'Projet Inconnu')
+        with st.expander(f"📍 Projet : {project_intitule}", expanded=False):
+            project_details = st.session_state['project_data']
+            st.markdown(":orange-badge[**Détails du Projet sélectionné :**]")
+        
+            # Affichage des détails du projet (récupéré des données 'Sites')
+            with st.container(border=True):
+                st.markdown("**Informations générales**")
+                cols1 = st.columns([1, 1, 1]) 
+                fields_l1 = utils.DISPLAY_GROUPS[0]
+                for i, field_key in enumerate(fields_l1):
+                    renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
+                    value = project_details.get(field_key, 'N/A')
+                    with cols1[i]: st.markdown(f"**{renamed_key}** : {value}")
+                    
+            with st.container(border=True):
+                st.markdown("**Points de charge Standard**")
+                cols2 = st.columns([1, 1, 1])
+                fields_l2 = utils.DISPLAY_GROUPS[1]
+                for i, field_key in enumerate(fields_l2):
+                    renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
+                    value = project_details.get(field_key, 'N/A')
+                    with cols2[i]: st.markdown(f"**{renamed_key}** : {value}")
 
-            if st.session_state.get('show_comment_on_error', False):
-                st.markdown("---")
-                st.markdown("### ✍️ Justification de l'Écart")
-                comment_row = pd.Series({'id': utils.COMMENT_ID, 'type': 'text'}) 
-                utils.render_question(comment_row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], 999, st.session_state['project_data']) 
-            
-            # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (PHASE) ---
-            if st.session_state['last_validation_errors']:
-                st.markdown(
-                    f'<div class="error-box"><b>⚠️ Erreurs :</b><br>Les questions suivantes nécessitent une réponse ou une correction :<br>{st.session_state["last_validation_errors"]}</div>', 
-                    unsafe_allow_html=True
-                )
-            # ------------------------------------------------------------------------
+            with st.container(border=True):
+                st.markdown("**Points de charge Pré-équipés**")
+                cols3 = st.columns([1, 1, 1])
+                fields_l3 = utils.DISPLAY_GROUPS[2]
+                for i, field_key in enumerate(fields_l3):
+                    renamed_key = utils.PROJECT_RENAME_MAP.get(field_key, field_key)
+                    value = project_details.get(field_key, 'N/A')
+                    with cols3[i]: st.markdown(f"**{renamed_key}** : {value}")
+        
+            st.write(":orange-badge[**Phases et Identification déjà complétées :**]")
+            for idx, item in enumerate(st.session_state['collected_data']):
+                st.write(f"• **{item['phase_name']}** : {len(item['answers'])} réponses")
 
-            st.markdown("---")
-            c1, c2 = st.columns([1, 2])
-            with c1:
-                if st.button("❌ Annuler"):
-                    st.session_state['step'] = 'LOOP_DECISION'
+        if st.session_state['step'] == 'LOOP_DECISION':
+            st.markdown("### 🔄 Gestion des Phases")
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("➕ Ajouter une phase"):
+                    st.session_state['step'] = 'FILL_PHASE'
                     st.session_state['current_phase_temp'] = {}
+                    st.session_state['current_phase_name'] = None
+                    st.session_state['iteration_id'] = str(uuid.uuid4())
                     st.session_state['show_comment_on_error'] = False
                     st.session_state['last_validation_errors'] = None
                     st.rerun()
-            with c2:
-                if st.button("💾 Valider la phase"):
+            with col2:
+                if st.button("🏁 Terminer l'audit"):
+                    st.session_state['step'] = 'FINISHED'
+                    st.rerun()
+            st.markdown('</div>', unsafe_allow_html=True)
+
+        elif st.session_state['step'] == 'FILL_PHASE':
+            df = st.session_state['df_struct']
+            ID_SECTION_NAME = df['section'].iloc[0]
+            ID_SECTION_CLEAN = str(ID_SECTION_NAME).strip().lower()
+            # Exclure la section d'identification et la ligne de question 'phase' si elle existe
+            SECTIONS_TO_EXCLUDE_CLEAN = {ID_SECTION_CLEAN, "phase"} 
+            all_sections_raw = df['section'].unique().tolist()
+            available_phases = []
+            for sec in all_sections_raw:
+                if pd.isna(sec) or not sec or str(sec).strip().lower() in SECTIONS_TO_EXCLUDE_CLEAN: continue
+                available_phases.append(sec)
+        
+            if not st.session_state['current_phase_name']:
+                  st.markdown("### 📑 Sélection de la phase")
+                  phase_choice = st.selectbox("Quelle phase ?", [""] + available_phases)
+                  if phase_choice:
+                      st.session_state['current_phase_name'] = phase_choice
+                      st.session_state['show_comment_on_error'] = False 
+                      st.session_state['last_validation_errors'] = None
+                      st.rerun()
+                  if st.button("⬅️ Retour"):
+                      st.session_state['step'] = 'LOOP_DECISION'
+                      st.session_state['current_phase_temp'] = {}
+                      st.session_state['show_comment_on_error'] = False
+                      st.session_state['last_validation_errors'] = None
+                      st.rerun()
+            else:
+                current_phase = st.session_state['current_phase_name']
+                st.markdown(f"### 📝 {current_phase}")
+                if st.button("🔄 Changer de phase"):
+                    st.session_state['current_phase_name'] = None
+                    st.session_state['current_phase_temp'] = {}
+                    st.session_state['iteration_id'] = str(uuid.uuid4())
                     st.session_state['show_comment_on_error'] = False
                     st.session_state['last_validation_errors'] = None
+                    st.rerun()
+                st.divider()
+            
+                section_questions = df[df['section'] == current_phase].copy()
+                section_questions['id_temp'] = pd.to_numeric(section_questions['id'], errors='coerce').fillna(0)
+                section_questions = section_questions.sort_values(by='id_temp')
 
-                    # --- CORRECTION ROBUSTESSE PHASE (Vérification df_struct) ---
-                    df_struct = st.session_state.get('df_struct')
-                    if df_struct is None:
-                        st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
-                        st.rerun() # <--- CORRECTION ICI
-                        st.stop()
-                    # -------------------------------------------------------------
-                    
-                    # --- NOUVEAU BLOC TRY/EXCEPT POUR ISOLER L'ATTRIBUTERROR ---
-                    try:
-                        is_valid, errors = utils.validate_section(
-                            df_struct, 
-                            current_phase, 
-                            st.session_state['current_phase_temp'], 
-                            st.session_state['collected_data'], 
-                            st.session_state['project_data']
-                        )
-                    except AttributeError as e:
-                        # Si l'erreur se produit DANS la fonction de validation
-                        st.session_state['last_validation_errors'] = f"Erreur critique dans la validation (AttributeError) : {e}"
-                        st.error(f"Erreur interne : {e}. Veuillez contacter le support. (Code: ATTRIB-VALID)")
-                        st.session_state['show_comment_on_error'] = True 
-                        st.rerun() # <--- CORRECTION IMPORTANTE ICI (Ligne qui plantait)
-                        st.stop()
-
-                    if is_valid:
-                        new_entry = {"phase_name": current_phase, "answers": st.session_state['current_phase_temp'].copy()}
-                        st.session_state['collected_data'].append(new_entry)
-                        st.success("Phase validée et enregistrée !")
+                visible_count = 0
+                for idx, (index, row) in enumerate(section_questions.iterrows()):
+                    if int(row.get('id', 0)) == utils.COMMENT_ID: continue
+                
+                    if utils.check_condition(row, st.session_state['current_phase_temp'], st.session_state['collected_data']):
+                        utils.render_question(row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], idx, st.session_state['project_data'])
+                        visible_count += 1
+            
+                if visible_count == 0 and not st.session_state.get('show_comment_on_error', False):
+                    st.warning("Aucune question visible dans cette phase.")
+
+                # Photos déjà déposées ailleurs dans l'audit : stockées une seule fois, comptées une seule fois
+                duplicate_msgs = utils.find_duplicate_photos(st.session_state['current_phase_temp'], st.session_state['collected_data'], current_phase)
+                if duplicate_msgs:
+                    st.warning("📸 **Photos en double détectées** (elles ne sont comptées qu'une fois) :\n\n" + "\n".join(f"- {m}" for m in duplicate_msgs))
+
+                if st.session_state.get('show_comment_on_error', False):
+                    st.markdown("---")
+                    st.markdown("### ✍️ Justification de l'Écart")
+                    comment_row = pd.Series({'id': utils.COMMENT_ID, 'type': 'text'}) 
+                    utils.render_question(comment_row, st.session_state['current_phase_temp'], current_phase, st.session_state['iteration_id'], 999, st.session_state['project_data']) 
+            
+                # --- AFFICHAGE PERSISTANT DES ERREURS DE VALIDATION (PHASE) ---
+                if st.session_state['last_validation_errors']:
+                    st.markdown(
+                        f'<div class="error-box"><b>⚠️ Erreurs :</b><br>Les questions suivantes nécessitent une réponse ou une correction :<br>{st.session_state["last_validation_errors"]}</div>', 
+                        unsafe_allow_html=True
+                    )
+                # ------------------------------------------------------------------------
+
+                st.markdown("---")
+                c1, c2 = st.columns([1, 2])
+                with c1:
+                    if st.button("❌ Annuler"):
                         st.session_state['step'] = 'LOOP_DECISION'
+                        st.session_state['current_phase_temp'] = {}
+                        utils.prune_photo_store(st.session_state['collected_data'], {})
+                        st.session_state['show_comment_on_error'] = False
                         st.session_state['last_validation_errors'] = None
                         st.rerun()
-                    else:
-                        # --- CORRECTION ROBUSTESSE D'ERREUR V2 ---
-                        cleaned_errors = [str(e) for e in errors if e is not None]
+                with c2:
+                    if st.button("💾 Valider la phase"):
+                        st.session_state['show_comment_on_error'] = False
+                        st.session_state['last_validation_errors'] = None
+
+                        # --- CORRECTION ROBUSTESSE PHASE (Vérification df_struct) ---
+                        df_struct = st.session_state.get('df_struct')
+                        if df_struct is None:
+                            st.error("Structure du formulaire manquante. Veuillez recharger le projet.")
+                            st.rerun() # <--- CORRECTION ICI
+                            st.stop()
+                        # -------------------------------------------------------------
+                    
+                        # --- NOUVEAU BLOC TRY/EXCEPT POUR ISOLER L'ATTRIBUTERROR ---
+                        try:
+                            is_valid, errors = utils.validate_section(
+                                df_struct, 
+                                current_phase, 
+                                st.session_state['current_phase_temp'], 
+                                st.session_state['collected_data'], 
+                                st.session_state['project_data']
+                            )
+                        except AttributeError as e:
+                            # Si l'erreur se produit DANS la fonction de validation
+                            st.session_state['last_validation_errors'] = f"Erreur critique dans la validation (AttributeError) : {e}"
+                            st.error(f"Erreur interne : {e}. Veuillez contacter le support. (Code: ATTRIB-VALID)")
+                            st.session_state['show_comment_on_error'] = True 
+                            st.rerun() # <--- CORRECTION IMPORTANTE ICI (Ligne qui plantait)
+                            st.stop()
 
-                        # Vérifie si l'erreur est liée au manque de justification pour les photos
-                        is_photo_error = any(f"Commentaire (ID {utils.COMMENT_ID})" in e for e in cleaned_errors)
-                        if is_photo_error: st.session_state['show_comment_on_error'] = True
+                        if is_valid:
+                            new_entry = {
+                                "phase_name": current_phase,
+                                "answers": st.session_state['current_phase_temp'].copy(),
+                                # Écart de photos tel que validé, repris par les statistiques agrégées
+                                "photo_check": utils.phase_photo_check(
+                                    df_struct, current_phase, st.session_state['current_phase_temp'],
+                                    st.session_state['collected_data'], st.session_state['project_data']
+                                ),
+                            }
+                            st.session_state['collected_data'].append(new_entry)
+                            utils.prune_photo_store(st.session_state['collected_data'], {})
+                            st.success("Phase validée et enregistrée !")
+                            st.session_state['step'] = 'LOOP_DECISION'
+                            st.session_state['last_validation_errors'] = None
+                            st.rerun()
+                        else:
+                            # --- CORRECTION ROBUSTESSE D'ERREUR V2 ---
+                            cleaned_errors = [str(e) for e in errors if e is not None]
+
+                            # Vérifie si l'erreur est liée au manque de justification pour les photos
+                            is_photo_error = any(f"Commentaire (ID {utils.COMMENT_ID})" in e for e in cleaned_errors)
+                            if is_photo_error: st.session_state['show_comment_on_error'] = True
                         
-                        html_errors = '<br>'.join([f"- {e}" for e in cleaned_errors])
-                        st.session_state['last_validation_errors'] = html_errors
-                        st.rerun() # <--- CORRECTION ICI
-                        # -----------------------------------------
-            st.markdown('</div>', unsafe_allow_html=True)
+                            html_errors = '<br>'.join([f"- {e}" for e in cleaned_errors])
+                            st.session_state['last_validation_errors'] = html_errors
+                            st.rerun() # <--- CORRECTION ICI
+                            # -----------------------------------------
+                st.markdown('</div>', unsafe_allow_html=True)
 
-# 5. FIN / EXPORTS
-elif st.session_state['step'] == 'FINISHED':
-    st.markdown("## 🎉 Formulaire Terminé")
-    project_name = st.session_state['project_data'].get('Intitulé', 'Projet Inconnu')
-    st.write(f"Projet : **{project_name}**")
-    st.warning('Il est attendu que vous téléchargiez le rapport Word ci-dessous pour le transmettre à votre interlocuteur.', icon="⚠️")
-    
-    
-    # 1. SAUVEGARDE FIREBASE
-    if not st.session_state['data_saved']:
-        with st.spinner("Sauvegarde des réponses dans Firestore..."):
-            success, result_message = utils.save_form_data(
-                st.session_state['collected_data'], 
-                st.session_state['project_data'],
-                st.session_state['submission_id'],
-                st.session_state['form_start_time']
-            )
+    # 5. FIN / EXPORTS
+    elif st.session_state['step'] == 'FINISHED':
+        st.markdown("## 🎉 Formulaire Terminé")
+        project_name = st.session_state['project_data'].get('Intitulé', 'Projet Inconnu')
+        st.write(f"Projet : **{project_name}**")
+        st.warning('Il est attendu que vous téléchargiez le rapport Word ci-dessous pour le transmettre à votre interlocuteur.', icon="⚠️")
 
-            if success:
-                st.session_state['data_saved'] = True
-                st.session_state['submission_id_final'] = result_message
-            else:
-                st.error(f"Erreur lors de la sauvegarde : {result_message}")
-                if st.button("Réessayer la sauvegarde"):
-                    st.rerun()
-    else:
-        st.info(f"Les données sont sauvegardées dans Firestore (ID: {st.session_state.get('submission_id_final', 'N/A')})")
-
-    if st.session_state['data_saved']:
-        # Préparation des exports
-        csv_data = utils.create_csv_export(
-            st.session_state['collected_data'], 
-            st.session_state['df_struct'], 
-            project_name, 
-            st.session_state['submission_id'], 
-            st.session_state['form_start_time']
-        )
-        zip_buffer = utils.create_zip_export(st.session_state['collected_data'])
-        date_str = datetime.now().strftime('%Y%m%d_%H%M')
-        
-        # --- 2. TÉLÉCHARGEMENT DIRECT ---
+        # Mode taille limitée : les photos sont réduites pour que chaque fichier passe la passerelle email
+        size_limited = st.toggle("📧 Limiter la taille des fichiers pour l'envoi par email", value=False)
+        budget_bytes = None
+        if size_limited:
+            budget_mb = st.number_input("Taille maximale par fichier (Mo)", min_value=1, max_value=100, value=utils.DEFAULT_EXPORT_BUDGET_MB, step=1)
+            budget_bytes = int(budget_mb * 1024 * 1024)
+
+        if 'export_date_str' not in st.session_state:
+            st.session_state['export_date_str'] = datetime.now().strftime('%Y%m%d_%H%M')
+        date_str = st.session_state['export_date_str']
+        file_name_csv = f"Export_{project_name}_{date_str}.csv"
+        file_name_zip = f"Photos_{project_name}_{date_str}.zip"
+        file_name_word = f"Rapport_{project_name}_{date_str}.docx"
+
+        # 1. PIPELINE : sauvegarde et exports lancés en parallèle (chaque étape une seule fois par session)
+        collected_data = st.session_state['collected_data']
+        df_struct = st.session_state['df_struct']
+        project_data = st.session_state['project_data']
+        submission_id = st.session_state['submission_id']
+        form_start_time = st.session_state['form_start_time']
+
+        futures = {}
+        if not st.session_state['data_saved']:
+            utils.get_db()  # Connexion initialisée dans le thread du script (secrets, messages d'erreur)
+            futures['save'] = utils.submit_save(st.session_state, submission_id, lambda: utils.save_form_data(
+                collected_data, project_data, submission_id, form_start_time
+            ))
+        futures['csv'] = utils.submit_export(st.session_state, 'csv', None, lambda: utils.create_csv_export(
+            collected_data, df_struct, project_name, submission_id, form_start_time
+        ))
+        if budget_bytes:
+            futures['zip'] = utils.submit_export(st.session_state, 'zip', budget_bytes, lambda: utils.create_zip_export_within_budget(
+                collected_data, budget_bytes
+            ))
+            futures['word'] = utils.submit_export(st.session_state, 'word', budget_bytes, lambda: utils.create_word_report_within_budget(
+                collected_data, df_struct, project_data, form_start_time, budget_bytes
+            ))
+        else:
+            futures['zip'] = utils.submit_export(st.session_state, 'zip', None, lambda: utils.create_zip_export(collected_data))
+            futures['word'] = utils.submit_export(st.session_state, 'word', None, lambda: utils.create_word_report_fast(
+                collected_data, df_struct, project_data, form_start_time
+            ))
+
+        # --- 2. TÉLÉCHARGEMENT DIRECT : chaque bouton apparaît dès que son fichier est prêt ---
+        save_placeholder = st.empty()
         st.markdown("### 📥 Télécharger les fichiers")
-        
         col_csv, col_zip, col_word = st.columns(3)
-        
-        file_name_csv = f"Export_{project_name}_{date_str}.csv"
-        with col_csv:
-            st.download_button(
-                label="📄 CSV", 
-                data=csv_data, 
-                file_name=file_name_csv, 
-                mime='text/csv',
-                use_container_width=True
-            )
+        placeholders = {'save': save_placeholder, 'csv': col_csv.empty(), 'zip': col_zip.empty(), 'word': col_word.empty()}
+        downloads = {
+            'csv': ("📄 CSV", file_name_csv, 'text/csv'),
+            'zip': ("📸 ZIP Photos", file_name_zip, 'application/zip'),
+            'word': ("📋 Rapport Word", file_name_word, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+        }
+        pending_labels = {
+            'save': "⏳ Sauvegarde des réponses dans Firestore...",
+            'csv': "⏳ Export CSV...",
+            'zip': "⏳ Archive photos...",
+            'word': "⏳ Rapport Word...",
+        }
+
+        def show_stage_result(name, future):
+            if name == 'save':
+                utils.forget_background(st.session_state, 'save')
+                try:
+                    success, result_message = future.result()
+                except Exception as e:
+                    success, result_message = False, str(e)
+                if success:
+                    st.session_state['data_saved'] = True
+                    st.session_state['submission_id_final'] = result_message
+                    save_placeholder.info(f"Les données sont sauvegardées dans Firestore (ID: {result_message})")
+                else:
+                    with save_placeholder.container():
+                        st.error(f"Erreur lors de la sauvegarde : {result_message}")
+                        if st.button("Réessayer la sauvegarde"):
+                            st.rerun()
+                return
 
-        if zip_buffer:
-            file_name_zip = f"Photos_{project_name}_{date_str}.zip"
-            with col_zip:
+            label, file_name, mime = downloads[name]
+            key = budget_bytes if name in ('zip', 'word') else None
+            try:
+                value = utils.collect_export(st.session_state, name, key, future)
+            except Exception as e:
+                placeholders[name].error(f"Erreur lors de la génération ({label}) : {e}")
+                return
+            data, size_report = value if isinstance(value, tuple) else (value, None)
+            if not data:
+                placeholders[name].empty()  # Pas de photo : pas d'archive
+                return
+            with placeholders[name].container():
                 st.download_button(
-                    label="📸 ZIP Photos", 
-                    data=zip_buffer.getvalue(), 
-                    file_name=file_name_zip, 
-                    mime='application/zip',
+                    label=label,
+                    data=data.getvalue() if hasattr(data, 'getvalue') else data,
+                    file_name=file_name,
+                    mime=mime,
                     use_container_width=True
                 )
+                # Taille obtenue en mode taille limitée
+                if size_report:
+                    size_mb = size_report['size'] / (1024 * 1024)
+                    msg = f"**{size_mb:.1f} Mo** (compression x{size_report['compression_ratio']:.1f})"
+                    if size_report['within_budget']: st.success(msg)
+                    else: st.warning(f"{msg} — le budget de {size_report['budget'] / (1024 * 1024):.0f} Mo n'a pas pu être atteint.")
+
+        if st.session_state['data_saved']:
+            save_placeholder.info(f"Les données sont sauvegardées dans Firestore (ID: {st.session_state.get('submission_id_final', 'N/A')})")
+
+        pending = {}
+        for name, future in futures.items():
+            if future.done():
+                show_stage_result(name, future)
+            else:
+                placeholders[name].info(pending_labels[name])
+                pending[future] = name
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                show_stage_result(pending.pop(future), future)
+
+        if st.session_state['data_saved']:
+            # --- 3. OUVERTURE DE L'APPLICATION NATIVE (MAILTO) ---
+            st.markdown("---")
+            st.markdown("### 📧 Partager par Email")
+            st.info("💡 Téléchargez d'abord les fichiers ci-dessus, puis cliquez sur le bouton ci-dessous pour ouvrir votre application email.")
         
-        # Génération du rapport Word
-        with st.spinner("Génération du rapport Word..."):
-            try:
-                word_buffer = utils.create_word_report(
-                    st.session_state['collected_data'],
-                    st.session_state['df_struct'],
-                    st.session_state['project_data'],
-                    st.session_state['form_start_time']
-                )
-                
-                file_name_word = f"Rapport_{project_name}_{date_str}.docx"
-                with col_word:
-                    st.download_button(
-                        label="📋 Rapport Word", 
-                        data=word_buffer.getvalue(), 
-                        file_name=file_name_word, 
-                        mime='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                        use_container_width=True
-                    )
-            except Exception as e:
-                st.error(f"Erreur lors de la génération du rapport Word : {e}")
-    
-        # --- 3. OUVERTURE DE L'APPLICATION NATIVE (MAILTO) ---
-        st.markdown("---")
-        st.markdown("### 📧 Partager par Email")
-        st.info("💡 Téléchargez d'abord les fichiers ci-dessus, puis cliquez sur le bouton ci-dessous pour ouvrir votre application email.")
-        
-        subject = f"Rapport Audit : {project_name}"
-        body = (
-            f"Bonjour,\n\n"
-            f"Veuillez trouver ci-joint le rapport d'audit pour le projet {project_name}.\n"
-            f"Fichiers à joindre :\n"
-            f"- {file_name_csv}\n"
-            f"- {file_name_zip}\n"
-            f"- {file_name_word}\n\n"
-            f"Cordialement."
-        )
+            subject = f"Rapport Audit : {project_name}"
+            body = (
+                f"Bonjour,\n\n"
+                f"Veuillez trouver ci-joint le rapport d'audit pour le projet {project_name}.\n"
+                f"Fichiers à joindre :\n"
+                f"- {file_name_csv}\n"
+                f"- {file_name_zip}\n"
+                f"- {file_name_word}\n\n"
+                f"Cordialement."
+            )
         
-        mailto_link = (
-            f"mailto:?" 
-            f"subject={urllib.parse.quote(subject)}" 
-            f"&body={urllib.parse.quote(body)}"
-        )
+            mailto_link = (
+                f"mailto:?" 
+                f"subject={urllib.parse.quote(subject)}" 
+                f"&body={urllib.parse.quote(body)}"
+            )
         
-        st.markdown(
-            f'<a href="{mailto_link}" target="_blank" style="text-decoration: none;">'
-            f'<button style="background-color: #E9630C; color: white; border: none; padding: 10px 20px; border-radius: 8px; width: 100%; font-size: 16px; cursor: pointer;">'
-            f'📧 Ouvrir l\'application Email'
-            f'</button>'
-            f'</a>',
-            unsafe_allow_html=True
-        )
+            st.markdown(
+                f'<a href="{mailto_link}" target="_blank" style="text-decoration: none;">'
+                f'<button style="background-color: #E9630C; color: white; border: none; padding: 10px 20px; border-radius: 8px; width: 100%; font-size: 16px; cursor: pointer;">'
+                f'📧 Ouvrir l\'application Email'
+                f'</button>'
+                f'</a>',
+                unsafe_allow_html=True
+            )
 
-    st.markdown("---")
-    if st.button("🔄 Recommencer l'audit"):
-        st.session_state.clear()
-        st.rerun()
+        st.markdown("---")
+        if st.button("🔄 Recommencer l'audit"):
+            utils.release_session_memory(st.session_state)
+            st.session_state.clear()
+            st.rerun()
@@ -0,0 +1,80 @@
+# bench_import.py : temps d'import de utils (python -X importtime), suivi dans le temps
+#
+# Usage :
+#   python benchmarks/bench_import.py                  # mesure et compare à benchmarks/import_baseline.json
+#   python benchmarks/bench_import.py --save-baseline
+#
+# Échoue aussi si `import utils` charge une dépendance lourde qui doit rester différée.
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_baseline.json')
+
+# Modules qui ne doivent pas être importés par `import utils`
+DEFERRED_MODULES = ['docx', 'firebase_admin', 'google.cloud.firestore', 'PIL.Image']
+
+LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def import_profile(module):
+    """Profil d'un import à froid : {module: (self µs, cumulé µs)} et liste des modules chargés."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    profile = {}
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            profile[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps d'import de utils")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help="Nombre de modules les plus coûteux à afficher")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--max-regression', type=float, default=0.20)
+    args = parser.parse_args()
+
+    profiles = [import_profile('utils') for _ in range(args.runs)]
+    total_ms = statistics.median(p['utils'][1] for p in profiles) / 1000
+    streamlit_ms = statistics.median(p.get('streamlit', (0, 0))[1] for p in profiles) / 1000
+    last = profiles[-1]
+
+    print(f"import utils (médiane de {args.runs}) : {total_ms:.0f} ms, dont streamlit {streamlit_ms:.0f} ms")
+    print("\nModules les plus coûteux (cumulé, dernier run) :")
+    for name, (_, cumulative) in sorted(last.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    # Les modules déjà chargés par streamlit lui-même ne sont pas imputables à utils
+    streamlit_modules = import_profile('streamlit')
+    failures = [m for m in DEFERRED_MODULES if m in last and m not in streamlit_modules]
+    for m in failures:
+        print(f"\n! {m} est importé par `import utils` alors qu'il doit être différé")
+
+    result = {'utils_ms': total_ms, 'streamlit_ms': streamlit_ms}
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nRéférence enregistrée dans {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        delta = total_ms / baseline['utils_ms'] - 1 if baseline.get('utils_ms') else 0.0
+        print(f"\nRéférence : {baseline['utils_ms']:.0f} ms ({delta:+.0%})")
+        if delta > args.max_regression:
+            failures.append('regression')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# bench_utils.py : benchmarks reproductibles des chemins critiques de utils (hors ligne)
+#
+# Usage :
+#   python benchmarks/bench_utils.py                          # mesure et compare à benchmarks/baseline.json s'il existe
+#   python benchmarks/bench_utils.py --save-baseline          # enregistre la référence
+#   python benchmarks/bench_utils.py --scale large --only create_word_report_fast
+#
+# Code de sortie 1 si une mesure dépasse la référence au-delà des seuils de régression.
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils
+import synthetic
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# (questions, sites, phases, photos) par échelle
+SCALES = {
+    'small': (60, 200, 3, 12),
+    'medium': (200, 2000, 6, 60),
+    'large': (600, 10000, 12, 240),
+}
+
+
+def build_cases(scale, seed):
+    """Retourne {nom: fonction sans argument} sur un jeu de données synthétique déterministe."""
+    n_questions, n_sites, n_phases, n_photos = SCALES[scale]
+    df_struct = synthetic.make_form_structure(n_questions, seed=seed)
+    df_site = synthetic.make_sites(n_sites, seed=seed)
+    project_data = synthetic.make_project_data(df_site)
+    collected_data = synthetic.make_audit(df_struct, n_phases, n_photos, seed=seed)
+    rows = [row for _, row in df_struct.iterrows()]
+
+    def run_check_condition():
+        for idx, phase in enumerate(collected_data):
+            for row in rows:
+                utils.check_condition(row, phase['answers'], collected_data[:idx])
+
+    def run_validate_section():
+        for idx, phase in enumerate(collected_data):
+            utils.validate_section(df_struct, phase['phase_name'], dict(phase['answers']), collected_data[:idx], project_data)
+
+    def run_word_report():
+        utils.create_word_report(collected_data, df_struct, project_data, None)
+
+    def run_word_report_fast():
+        utils.create_word_report_fast(collected_data, df_struct, project_data, None)
+
+    def run_zip_export():
+        utils.create_zip_export(collected_data)
+
+    audits = [{'submission_id': f'bench-{k}', 'collected_phases': collected_data, 'project_details': project_data} for k in range(50)]
+    structure = utils.compile_form_structure(df_struct)
+
+    def run_revalidate_audits():
+        utils.revalidate_audits(audits, structure=structure)
+
+    def run_csv_export():
+        utils.create_csv_export(collected_data, df_struct, project_data['Intitulé'], 'bench', None)
+
+    return {
+        'check_condition': run_check_condition,
+        'validate_section': run_validate_section,
+        'create_word_report': run_word_report,
+        'create_word_report_fast': run_word_report_fast,
+        'create_zip_export': run_zip_export,
+        'create_csv_export': run_csv_export,
+        'revalidate_audits': run_revalidate_audits,
+    }
+
+
+def measure(func, repeat):
+    """(meilleur temps en s, pic mémoire Python en Mo). Le pic est mesuré à part pour ne pas fausser le temps."""
+    func()  # Échauffement : caches, modèle Word, analyses d'images en arrière-plan
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak / (1024 * 1024)
+
+
+def compare(results, baseline, max_time_regression, max_memory_regression):
+    """Lignes de rapport et liste des régressions par rapport à la référence."""
+    lines, regressions = [], []
+    lines.append(f"{'fonction':<26}{'temps (ms)':>12}{'réf.':>10}{'Δ':>8}{'pic (Mo)':>11}{'réf.':>9}{'Δ':>8}")
+    for name, res in results.items():
+        ref = baseline.get(name)
+        t_ms, peak = res['time_s'] * 1000, res['peak_mb']
+        if ref is None:
+            lines.append(f"{name:<26}{t_ms:>12.1f}{'-':>10}{'':>8}{peak:>11.2f}{'-':>9}")
+            continue
+        dt = res['time_s'] / ref['time_s'] - 1 if ref['time_s'] else 0.0
+        dm = peak / ref['peak_mb'] - 1 if ref['peak_mb'] else 0.0
+        lines.append(f"{name:<26}{t_ms:>12.1f}{ref['time_s'] * 1000:>10.1f}{dt:>+8.0%}{peak:>11.2f}{ref['peak_mb']:>9.2f}{dm:>+8.0%}")
+        if dt > max_time_regression: regressions.append(f"{name} : temps {dt:+.0%}")
+        if dm > max_memory_regression: regressions.append(f"{name} : mémoire {dm:+.0%}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks des fonctions critiques de utils")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='medium')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', help="Sous-ensemble de fonctions à mesurer")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--max-time-regression', type=float, default=0.20, help="Régression de temps tolérée (0.20 = +20 %%)")
+    parser.add_argument('--max-memory-regression', type=float, default=0.20)
+    args = parser.parse_args()
+
+    cases = build_cases(args.scale, args.seed)
+    if args.only:
+        cases = {name: func for name, func in cases.items() if name in args.only}
+
+    results = {}
+    for name, func in cases.items():
+        time_s, peak_mb = measure(func, args.repeat)
+        results[name] = {'time_s': time_s, 'peak_mb': peak_mb}
+
+    all_baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            all_baselines = json.load(f)
+
+    print(f"Échelle : {args.scale} {SCALES[args.scale]} (questions, sites, phases, photos), meilleur de {args.repeat}")
+    lines, regressions = compare(results, all_baselines.get(args.scale, {}), args.max_time_regression, args.max_memory_regression)
+    print('\n'.join(lines))
+
+    if args.save_baseline:
+        all_baselines.setdefault(args.scale, {}).update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(all_baselines, f, indent=2, sort_keys=True)
+        print(f"Référence enregistrée dans {args.baseline}")
+        return 0
+
+    if regressions:
+        print("\nRégressions détectées :\n- " + "\n- ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
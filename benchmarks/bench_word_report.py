@@ -0,0 +1,47 @@
+# bench_word_report.py : compare create_word_report et create_word_report_fast sur un audit synthétique
+# Usage : python benchmarks/bench_word_report.py [--answers 500] [--phases 5] [--repeat 3]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils
+import synthetic
+
+
+def best_of(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du rendu Word (référence vs rapide)")
+    parser.add_argument('--answers', type=int, default=500)
+    parser.add_argument('--phases', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    collected_data, df_struct = synthetic.make_text_audit(args.answers, args.phases)
+    project_data = {key: 'N/A' for group in utils.DISPLAY_GROUPS for key in group}
+    project_data['Intitulé'] = 'Projet Benchmark'
+    call_args = (collected_data, df_struct, project_data, None)
+
+    # Premier appel hors mesure : construit le modèle mis en cache par processus
+    utils.create_word_report_fast(*call_args)
+
+    t_ref = best_of(utils.create_word_report, args.repeat, *call_args)
+    t_fast = best_of(utils.create_word_report_fast, args.repeat, *call_args)
+    print(f"Audit : {args.answers} réponses, {args.phases} phases (meilleur de {args.repeat})")
+    print(f"create_word_report      : {t_ref * 1000:8.1f} ms")
+    print(f"create_word_report_fast : {t_fast * 1000:8.1f} ms")
+    print(f"Accélération            : x{t_ref / t_fast:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# check_bulk_loader.py : vérifie le différentiel de bulk_loader sur un LocalStore (sans Firestore)
+#
+# Usage :
+#   python benchmarks/check_bulk_loader.py
+#
+# Couvre : ligne inchangée, cellule vidée (DELETE_FIELD), champ sous un ancien nom (renommé, ancien champ
+# supprimé), nouveau document sans champs vides, --prune. Les écritures sont appliquées puis le
+# différentiel recalculé doit être vide. Code de sortie 1 au premier écart.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from firebase_admin import firestore
+
+import bulk_loader
+from local_store import LocalStore
+
+
+def apply(store, collection, writes, deletes):
+    batch = store.batch()
+    for doc_id, data in writes: batch.set(store.collection(collection).document(doc_id), data, merge=True)
+    for doc_id in deletes: batch.delete(store.collection(collection).document(doc_id))
+    batch.commit()
+
+
+def diff(store, kind, records, prune=False):
+    collection, key_field, _ = bulk_loader.COLLECTIONS[kind]
+    return bulk_loader.compute_diff(kind, records, list(store.collection(collection).stream()), key_field, prune)
+
+
+def check_sites():
+    store = LocalStore()
+    store.seed('Sites', [
+        {'Intitulé': 'Ville-A', 'R [Plan de Déploiement]': 3, 'Commentaire interne': 'conservé'},
+        {'Intitulé': 'Ville-B', 'R [Plan de Déploiement]': 2},
+        {'Intitulé': 'Ville-C', 'R [Plan de Déploiement]': 1},
+    ], id_field='Intitulé')
+    records = [
+        {'Intitulé': 'Ville-A', 'R [Plan de Déploiement]': None},  # Cellule vidée
+        {'Intitulé': 'Ville-B', 'R [Plan de Déploiement]': 2},  # Inchangée
+        {'Intitulé': 'Ville-D', 'R [Plan de Déploiement]': None},  # Nouvelle
+    ]
+    writes, deletes, unchanged = diff(store, 'sites', records, prune=True)
+    writes = dict(writes)
+    assert unchanged == 1, unchanged
+    assert set(writes) == {'Ville-A', 'Ville-D'}, writes
+    assert writes['Ville-A']['R [Plan de Déploiement]'] is firestore.DELETE_FIELD, writes['Ville-A']
+    assert writes['Ville-D'] == {'Intitulé': 'Ville-D'}, writes['Ville-D']
+    assert deletes == ['Ville-C'], deletes
+
+    apply(store, 'Sites', writes.items(), deletes)
+    site_a = store.collection('Sites').document('Ville-A').get().to_dict()
+    assert site_a == {'Intitulé': 'Ville-A', 'Commentaire interne': 'conservé'}, site_a
+    assert diff(store, 'sites', records, prune=True) == ([], [], 3)
+
+
+def check_question_aliases():
+    store = LocalStore()
+    store.seed('formsquestions', [
+        {'id': 1, 'type': 'select', 'Conditon value': '', 'condition on': 0},  # Anciens noms, mêmes valeurs
+        {'id': 2, 'type': 'text', 'Condition value': '1=Oui', 'Condition on': 1},
+    ], id_field='id')
+    records = [
+        {'id': 1, 'type': 'select', 'Condition value': None, 'Condition on': 0},
+        {'id': 2, 'type': 'text', 'Condition value': '1=Oui', 'Condition on': 1},
+    ]
+    writes, _, unchanged = diff(store, 'questions', records)
+    writes = dict(writes)
+    assert unchanged == 1 and set(writes) == {'1'}, (writes, unchanged)
+    assert writes['1']['Conditon value'] is firestore.DELETE_FIELD
+    assert writes['1']['condition on'] is firestore.DELETE_FIELD
+
+    apply(store, 'formsquestions', writes.items(), [])
+    question = store.collection('formsquestions').document('1').get().to_dict()
+    assert question == {'id': 1, 'type': 'select', 'Condition on': 0}, question
+    assert diff(store, 'questions', records) == ([], [], 2)
+
+
+def main():
+    for check in (check_sites, check_question_aliases):
+        try:
+            check()
+        except AssertionError as e:
+            print(f"{check.__name__} : échec {e}")
+            return 1
+        print(f"{check.__name__} : ok")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# check_revalidation.py : vérifie que revalidate_audits rend les mêmes verdicts que validate_section
+#
+# Usage :
+#   python benchmarks/check_revalidation.py                 # 20 audits synthétiques
+#   python benchmarks/check_revalidation.py --audits 100 --seed 3
+#
+# Pour chaque phase d'audits synthétiques (réponses vidées au hasard, justifications, photos en double),
+# compare question par question les réponses manquantes, l'écart de photos et la justification exigée,
+# sous la forme en session (objets fichier) et sous la forme stockée dans 'FormAnswers' (« Fichiers: »).
+# Code de sortie 1 au premier désaccord.
+import argparse
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils
+import synthetic
+
+MISSING_RE = re.compile(r'^Question (\d+) : ')
+
+
+def perturb(collected_data, rng):
+    """Vide des réponses, ajoute des justifications et des photos en double, pour couvrir toutes les règles."""
+    for phase in collected_data:
+        answers = phase['answers']
+        for q_id, val in list(answers.items()):
+            if isinstance(val, list):
+                if val and rng.random() < 0.3: val.append(val[0])  # Même photo déposée deux fois
+            elif rng.random() < 0.2:
+                answers[q_id] = rng.choice(['', None, 0])
+        if rng.random() < 0.5:
+            answers[utils.COMMENT_ID] = 'Écart justifié par le test'
+    return collected_data
+
+
+def stored_phases(collected_data):
+    """Phases telles que save_form_data les écrit dans 'FormAnswers'."""
+    phases = []
+    for phase in collected_data:
+        answers = {}
+        for k, v in phase['answers'].items():
+            if isinstance(v, list) and v and hasattr(v[0], 'read'):
+                # Les noms identifient les photos stockées : un doublon garde le nom de l'original
+                answers[str(k)] = f"Fichiers: {', '.join(f.name for f in v)}"
+            else:
+                answers[str(k)] = v
+        phases.append({'phase_name': phase['phase_name'], 'answers': answers})
+    return phases
+
+
+def reference_verdicts(df_struct, collected_data, project_data):
+    """Verdicts de validate_section par phase : (ids manquants, écart de photos, justification manquante)."""
+    verdicts = []
+    for idx, phase in enumerate(collected_data):
+        answers = dict(phase['answers'])
+        check = utils.phase_photo_check(df_struct, phase['phase_name'], answers, collected_data[:idx], project_data)
+        _, missing = utils.validate_section(df_struct, phase['phase_name'], answers, collected_data[:idx], project_data)
+        missing_ids = {int(m.group(1)) for m in map(MISSING_RE.match, missing) if m}
+        justification_missing = any(msg.startswith(f"**Commentaire (ID {utils.COMMENT_ID})") for msg in missing)
+        verdicts.append((missing_ids, check['has_gap'], justification_missing))
+    return verdicts
+
+
+def revalidated_verdicts(result, n_phases):
+    verdicts = []
+    for idx in range(n_phases):
+        rows = result[result['Phase_index'] == idx]
+        verdicts.append((
+            set(rows.loc[rows['Manquante'], 'Question_ID'].astype(int)),
+            bool(rows['Ecart_photos'].any()),
+            bool(rows['Justification_manquante'].any()),
+        ))
+    return verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concordance revalidate_audits / validate_section")
+    parser.add_argument('--audits', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=120)
+    parser.add_argument('--phases', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df_site = synthetic.make_sites(args.audits, seed=args.seed)
+    # Trois versions de structure, compilées une fois chacune comme pour un retraitement en masse
+    versions = {}
+    for v in range(3):
+        df_struct = synthetic.make_form_structure(args.questions, seed=args.seed + v)
+        versions[v] = (df_struct, utils.compile_form_structure(df_struct))
+
+    checked, gaps = 0, 0
+    for a in range(args.audits):
+        rng = random.Random(args.seed * 1000 + a)
+        df_struct, structure = versions[a % 3]
+        project_data = synthetic.make_project_data(df_site, a)
+        collected_data = perturb(synthetic.make_audit(df_struct, args.phases, n_photos=rng.randint(0, 30), photo_size=(64, 48), seed=a), rng)
+
+        expected = reference_verdicts(df_struct, collected_data, project_data)
+        for form, phases in (('session', collected_data), ('stockée', stored_phases(collected_data))):
+            audit = {'submission_id': f'check-{a}', 'collected_phases': phases, 'project_details': project_data}
+            got = revalidated_verdicts(utils.revalidate_audits([audit], structure=structure), len(phases))
+            for idx, (ref, res) in enumerate(zip(expected, got)):
+                if ref != res:
+                    print(f"Désaccord audit {a}, phase {idx} ({phases[idx]['phase_name']}, forme {form}) :\n"
+                          f"  validate_section : manquants={sorted(ref[0])} écart={ref[1]} justification={ref[2]}\n"
+                          f"  revalidate_audits : manquants={sorted(res[0])} écart={res[1]} justification={res[2]}")
+                    return 1
+        checked += len(collected_data)
+        gaps += sum(v[1] for v in expected)
+
+    print(f"{checked} phases concordantes ({gaps} avec écart de photos), formes en session et stockée.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# load_test.py : test de charge multi-sessions de app.py (sans navigateur ni Firestore)
+#
+# Chaque session simulée parcourt le flux complet via streamlit.testing.AppTest : recherche du projet,
+# identification, plusieurs phases, fin d'audit (sauvegarde + exports). Firestore est remplacé par
+# local_store.LocalStore, alimenté avec des données synthétiques.
+#
+# Usage :
+#   python benchmarks/load_test.py --sessions 1,2,4,8,16 --phases 3 --photos-per-phase 6
+#
+# Chaque session simulée tourne dans son propre processus : AppTest installe un Runtime factice global
+# (et modifie la configuration globale) le temps d'un run(), puis le remet à None. Deux run() concurrents
+# dans un même processus se perturbent (« Runtime hasn't been created ») et fausseraient les mesures.
+# Les processus démarrent ensemble ; le débit est calculé sur la durée des audits, préparation exclue.
+# Conséquence : les caches et budgets propres au processus (données de référence, mémoire globale)
+# ne sont pas partagés entre sessions simulées ; le RSS rapporté est celui du processus le plus chargé.
+#
+# Une « interaction » est un run() AppTest (clic ou saisie), reruns déclenchés par st.rerun compris.
+# AppTest ne sait pas piloter st.file_uploader : les photos sont ajoutées à la phase dans session_state
+# juste après sa validation, pour que la sauvegarde et les exports en supportent le poids réel.
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils
+import synthetic
+from local_store import LocalStore
+
+APP_PATH = os.path.join(ROOT, 'app.py')
+
+
+def setup_backend(n_questions, n_sites, seed):
+    """Installe un LocalStore alimenté ; retourne (intitulés de projets, phases disponibles)."""
+    df_struct = synthetic.make_form_structure(n_questions, seed=seed)
+    # Les dépôts de photos ne sont pas pilotables : les questions photo ne doivent pas bloquer la validation
+    df_struct.loc[df_struct['type'] == 'photo', 'obligatoire'] = 'Non'
+    df_site = synthetic.make_sites(n_sites, seed=seed)
+
+    store = LocalStore()
+    store.seed('formsquestions', df_struct.to_dict('records'), id_field='id')
+    store.seed('Sites', df_site.to_dict('records'))
+    utils.set_storage_backend(store)
+    phases = [s for s in df_struct['section'].unique() if s != synthetic.SECTIONS[0]]
+    return df_site['Intitulé'].tolist(), phases
+
+
+class SimulatedSession:
+    def __init__(self, timeout):
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.latencies = []
+
+    def run(self, target=None):
+        t0 = time.perf_counter()
+        (target or self.at).run()
+        self.latencies.append(time.perf_counter() - t0)
+        if self.at.exception:
+            raise RuntimeError(f"Exception dans l'application : {self.at.exception[0].value}")
+
+    def step(self):
+        return self.at.session_state['step']
+
+    def click(self, label_prefix):
+        button = next(b for b in self.at.button if b.label.startswith(label_prefix))
+        button.click()
+        self.run()
+
+    def fill_visible_questions(self):
+        """Renseigne les questions visibles encore vides ; retourne True si un rerun est nécessaire."""
+        changed = False
+        for w in self.at.text_input:
+            if w.label == 'R' and not w.value:
+                w.input('RAS')
+                changed = True
+        for w in self.at.text_area:
+            if w.label == 'R' and not w.value:
+                w.input('Justification saisie par le test de charge')
+                changed = True
+        for w in self.at.selectbox:
+            if w.label == 'S' and not w.value:
+                options = [o for o in w.options if o]
+                if options:
+                    w.select('Oui' if 'Oui' in options else options[0])
+                    changed = True
+        for w in self.at.number_input:
+            if w.label == 'N' and not w.value:
+                w.set_value(1)
+                changed = True
+        return changed
+
+    def fill_and_validate(self, validate_label, done_step):
+        # Les réponses peuvent rendre visibles de nouvelles questions conditionnelles
+        for _ in range(4):
+            if not self.fill_visible_questions(): break
+            self.run()
+        for _ in range(2):
+            self.click(validate_label)
+            if self.step() == done_step: return
+            # Écart de photos : la justification apparaît, on la renseigne puis on revalide
+            self.fill_visible_questions()
+        raise RuntimeError(f"Validation impossible ({validate_label}) : étape {self.step()}")
+
+
+def run_audit(session_idx, project_names, phases, n_phases, photos_per_phase, photo_pool, timeout):
+    """Parcourt un audit complet ; retourne les latences de chaque interaction."""
+    s = SimulatedSession(timeout)
+    s.run()
+    if s.step() != 'PROJECT':
+        raise RuntimeError(f"Chargement initial en échec : étape {s.step()}")
+
+    project = project_names[session_idx % len(project_names)]
+    s.at.text_input(key='project_search_input').input(project[:10])
+    s.run()
+    next(sb for sb in s.at.selectbox if sb.label == 'Résultats de la recherche').select(project)
+    s.run()
+    s.click("✅ Démarrer")
+    s.fill_and_validate("✅ Valider l'identification", 'LOOP_DECISION')
+
+    for p in range(n_phases):
+        s.click("➕ Ajouter une phase")
+        next(sb for sb in s.at.selectbox if sb.label == 'Quelle phase ?').select(phases[(session_idx + p) % len(phases)])
+        s.run()
+        s.fill_and_validate("💾 Valider la phase", 'LOOP_DECISION')
+
+        collected_data = s.at.session_state['collected_data']
+        photo_slots = [v for v in collected_data[-1]['answers'].values() if isinstance(v, list)]
+        for k in range(photos_per_phase if photo_slots else 0):
+            data = photo_pool[k % len(photo_pool)] + f'session-{session_idx}-{p}-{k}'.encode()
+            photo_slots[k % len(photo_slots)].append(synthetic.named_upload(data, f'IMG_{p}_{k}.jpg'))
+        s.at.session_state['collected_data'] = collected_data
+
+    s.click("🏁 Terminer")
+    if not s.at.session_state['data_saved']:
+        raise RuntimeError("La sauvegarde de fin d'audit a échoué")
+    return s.latencies
+
+
+def current_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run_session(session_idx, start_at, args):
+    """Un audit complet dans ce processus ; retourne (latences, erreur ou None, RSS en Mo, durée de l'audit).
+
+    'start_at' (horloge time.time) aligne le départ des processus une fois leur préparation terminée.
+    """
+    project_names, phases = setup_backend(args.questions, args.sites, args.seed)
+    photo_pool = [synthetic.make_photo(seed=args.seed + k) for k in range(4)]
+    time.sleep(max(0.0, start_at - time.time()))
+    t0 = time.perf_counter()
+    try:
+        latencies, error = run_audit(session_idx, project_names, phases, args.phases, args.photos_per_phase, photo_pool, args.timeout), None
+    except Exception as e:
+        latencies, error = [], str(e)
+    return latencies, error, current_rss_mb(), time.perf_counter() - t0
+
+
+def percentile(values, q):
+    if not values: return float('nan')
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_level(n_sessions, args):
+    latencies, errors, rss_list, walls = [], [], [], []
+    start_at = time.time() + args.warmup
+    with ProcessPoolExecutor(max_workers=n_sessions) as pool:
+        for lat, err, rss, wall in pool.map(run_session, range(n_sessions), [start_at] * n_sessions, [args] * n_sessions):
+            latencies.extend(lat)
+            if err: errors.append(err)
+            rss_list.append(rss)
+            walls.append(wall)
+    wall = max(walls)
+    return {
+        'sessions': n_sessions,
+        'interactions': len(latencies),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'mean': statistics.fmean(latencies) if latencies else float('nan'),
+        'throughput': len(latencies) / wall if wall else 0.0,
+        'audits_per_min': (n_sessions - len(errors)) / wall * 60 if wall else 0.0,
+        'rss_max_mb': max(rss_list),
+        'errors': errors,
+        'wall': wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge multi-sessions de app.py")
+    parser.add_argument('--sessions', default='1,2,4,8', help="Paliers de sessions concurrentes, séparés par des virgules")
+    parser.add_argument('--warmup', type=float, default=20, help="Délai (s) laissé aux processus pour se préparer avant le départ commun")
+    parser.add_argument('--phases', type=int, default=3)
+    parser.add_argument('--photos-per-phase', type=int, default=6)
+    parser.add_argument('--questions', type=int, default=60)
+    parser.add_argument('--sites', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=120, help="Délai maximal d'un run() AppTest (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8}{'interact.':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}"
+          f"{'inter./s':>10}{'audits/min':>11}{'RSS max (Mo)':>14}{'erreurs':>9}")
+    for n_sessions in [int(x) for x in args.sessions.split(',') if x.strip()]:
+        res = run_level(n_sessions, args)
+        print(f"{res['sessions']:>8}{res['interactions']:>10}{res['p50'] * 1000:>10.0f}{res['p95'] * 1000:>10.0f}"
+              f"{res['p99'] * 1000:>10.0f}{res['throughput']:>10.2f}{res['audits_per_min']:>11.1f}"
+              f"{res['rss_max_mb']:>14.0f}{len(res['errors']):>9}")
+        for err in res['errors'][:3]:
+            print(f"    ! {err}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# local_store.py : stand-in en mémoire de Firestore pour les benchmarks et tests de charge
+#
+# Couvre le sous-ensemble de l'API utilisé par l'application (collection, document, order_by, where ==,
+# get, stream, set avec merge, delete, batch, Increment, DELETE_FIELD).
+# S'installe avec utils.set_storage_backend.
+import copy
+import threading
+import uuid
+
+
+class _LocalSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+def _is_delete_field(value):
+    # firestore.DELETE_FIELD est un Sentinel ; SERVER_TIMESTAMP en est un autre
+    return type(value).__name__ == 'Sentinel' and 'delete' in str(getattr(value, 'description', '')).lower()
+
+
+def _merge_into(target, data):
+    for key, value in data.items():
+        if _is_delete_field(value):
+            target.pop(key, None)
+        elif type(value).__name__ == 'Increment':
+            target[key] = target.get(key, 0) + value.value
+        elif isinstance(value, dict):
+            sub = target.get(key)
+            target[key] = _merge_into(sub if isinstance(sub, dict) else {}, value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+class _LocalDocument:
+    def __init__(self, store, collection, doc_id):
+        self._store, self._collection, self.id = store, collection, doc_id
+
+    def set(self, data, merge=False):
+        with self._store._lock:
+            docs = self._store._collections.setdefault(self._collection, {})
+            docs[self.id] = _merge_into(docs.get(self.id, {}) if merge else {}, data)
+
+    def delete(self):
+        with self._store._lock:
+            self._store._collections.get(self._collection, {}).pop(self.id, None)
+
+    def get(self):
+        with self._store._lock:
+            data = self._store._collections.get(self._collection, {}).get(self.id)
+            return _LocalSnapshot(self.id, copy.deepcopy(data) if data is not None else None)
+
+
+class _LocalQuery:
+    def __init__(self, store, collection, order_field=None):
+        self._store, self._collection, self._order_field = store, collection, order_field
+        self._filters = []
+
+    def order_by(self, field):
+        query = _LocalQuery(self._store, self._collection, field)
+        query._filters = self._filters
+        return query
+
+    def where(self, field, op, value):
+        if op != '==': raise ValueError(f"Opérateur non pris en charge par LocalStore : {op!r} (seul '==' l'est)")
+        query = _LocalQuery(self._store, self._collection, self._order_field)
+        query._filters = self._filters + [(field, value)]
+        return query
+
+    def stream(self):
+        with self._store._lock:
+            items = list(self._store._collections.get(self._collection, {}).items())
+        items = [(doc_id, data) for doc_id, data in items if all(data.get(f) == v for f, v in self._filters)]
+        if self._order_field:
+            items.sort(key=lambda item: item[1].get(self._order_field, 0))
+        for doc_id, data in items:
+            yield _LocalSnapshot(doc_id, copy.deepcopy(data))
+
+    def get(self):
+        return list(self.stream())
+
+
+class _LocalCollection(_LocalQuery):
+    def document(self, doc_id=None):
+        return _LocalDocument(self._store, self._collection, doc_id or uuid.uuid4().hex)
+
+
+class _LocalBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self._writes.append((doc_ref, data, merge))
+
+    def delete(self, doc_ref):
+        self._writes.append((doc_ref, None, False))
+
+    def commit(self):
+        for doc_ref, data, merge in self._writes:
+            if data is None: doc_ref.delete()
+            else: doc_ref.set(data, merge=merge)
+        self._writes = []
+
+
+class LocalStore:
+    """Base de données en mémoire, compatible avec les appels Firestore de utils."""
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return _LocalCollection(self, name)
+
+    def batch(self):
+        return _LocalBatch()
+
+    def seed(self, collection, records, id_field=None):
+        """Charge une liste de dictionnaires dans une collection (identifiants tirés de id_field si fourni)."""
+        for idx, record in enumerate(records):
+            doc_id = str(record[id_field]) if id_field else str(idx)
+            self.collection(collection).document(doc_id).set(record)
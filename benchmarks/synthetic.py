@@ -0,0 +1,133 @@
+# synthetic.py : générateurs de données synthétiques pour les benchmarks (sans Firestore ni navigateur)
+import io
+import random
+
+import pandas as pd
+from PIL import Image, ImageFilter
+
+import utils
+
+SECTIONS = ['Identification', 'Bornes AC', 'Bornes DC', 'Génie civil', 'Raccordement', 'Signalétique']
+SELECT_OPTIONS = ['Oui', 'Non', 'Sans objet']
+
+
+def make_form_structure(n_questions, condition_ratio=0.4, seed=0):
+    """Structure de formulaire de n_questions réparties sur SECTIONS, avec conditions OU/ET imbriquées.
+
+    Les conditions ne portent que sur des questions 'select' antérieures, comme dans 'formsquestions'.
+    """
+    rng = random.Random(seed)
+    rows, select_ids = [], []
+    per_section = max(1, n_questions // len(SECTIONS))
+    for i in range(n_questions):
+        q_id = i + 1
+        if q_id == utils.COMMENT_ID:
+            q_id = n_questions + 1  # COMMENT_ID est réservé à la justification d'écart photo
+        section = SECTIONS[min(i // per_section, len(SECTIONS) - 1)]
+        q_type = 'text' if section == SECTIONS[0] else rng.choice(['text', 'select', 'select', 'number', 'photo'])
+        condition = ''
+        if select_ids and rng.random() < condition_ratio:
+            blocks = []
+            for _ in range(rng.randint(1, 3)):
+                atoms = [f'{rng.choice(select_ids)}={rng.choice(SELECT_OPTIONS)}' for _ in range(rng.randint(1, 3))]
+                blocks.append(' ET '.join(atoms))
+            condition = ' OU '.join(blocks)
+        rows.append({
+            'id': q_id, 'section': section, 'type': q_type,
+            'question': f'Question synthétique {q_id} ({q_type}) ?',
+            'options': ','.join(SELECT_OPTIONS) if q_type == 'select' else '',
+            'Description': '', 'obligatoire': rng.choice(['Oui', 'Non']),
+            'Condition on': 1 if condition else 0, 'Condition value': condition,
+        })
+        if q_type == 'select':
+            select_ids.append(q_id)
+    return pd.DataFrame(rows)
+
+
+def make_sites(n_sites, seed=0):
+    """Table 'Sites' de n_sites projets avec les colonnes de PROJECT_RENAME_MAP."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_sites):
+        row = {col: rng.randint(0, 6) for col in utils.PROJECT_RENAME_MAP if col != 'Intitulé'}
+        row['Intitulé'] = f'Ville-{i:05d} - Parking {rng.choice(["Centre", "Gare", "Mairie", "Zone Est"])}'
+        row['Fournisseur Bornes AC [Bornes]'] = rng.choice(['Alpha', 'Beta'])
+        row['Fournisseur Bornes DC [Bornes]'] = rng.choice(['Gamma', 'Delta'])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def make_photo(width=1600, height=1200, quality=85, seed=0):
+    """JPEG réaliste (dégradés et texture), de l'ordre de quelques centaines de Ko en 1600x1200."""
+    rng = random.Random(seed)
+    base = Image.frombytes('RGB', (width // 16, height // 16), rng.randbytes((width // 16) * (height // 16) * 3))
+    img = base.resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2))
+    texture = Image.effect_noise((width, height), 24).convert('RGB')
+    img = Image.blend(img, texture, 0.15)
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+def named_upload(data, name):
+    """Équivalent minimal d'un UploadedFile Streamlit : BytesIO nommé."""
+    buf = io.BytesIO(data)
+    buf.name = name
+    return buf
+
+
+def make_answers(section_rows, rng):
+    """Réponses plausibles pour une section ; les questions photo reçoivent une liste vide à remplir."""
+    answers = {}
+    for _, row in section_rows.iterrows():
+        q_id, q_type = int(row['id']), row['type']
+        if q_type == 'select':
+            answers[q_id] = rng.choice(SELECT_OPTIONS)
+        elif q_type == 'number':
+            answers[q_id] = rng.randint(1, 10)
+        elif q_type == 'photo':
+            answers[q_id] = []
+        else:
+            answers[q_id] = f'Réponse {q_id}'
+    return answers
+
+
+def make_audit(df_struct, n_phases, n_photos, photo_size=(1600, 1200), seed=0):
+    """Audit complet (collected_data) : identification puis n_phases phases, n_photos photos distinctes au total."""
+    rng = random.Random(seed)
+    sections = [s for s in df_struct['section'].unique() if s != SECTIONS[0]]
+    collected_data = [{'phase_name': SECTIONS[0], 'answers': make_answers(df_struct[df_struct['section'] == SECTIONS[0]], rng)}]
+    for p in range(n_phases):
+        section = sections[p % len(sections)]
+        collected_data.append({'phase_name': section, 'answers': make_answers(df_struct[df_struct['section'] == section], rng)})
+
+    slots = [answer for phase in collected_data for answer in phase['answers'].values() if isinstance(answer, list)]
+    if not slots or not n_photos:
+        return collected_data
+    # Un petit lot d'images encodées, rendues distinctes par un suffixe après le marqueur de fin JPEG
+    # (ignoré par les décodeurs) : tailles réalistes sans payer un encodage par photo
+    photo_pool = [make_photo(*photo_size, seed=seed + k) for k in range(min(8, n_photos))]
+    for k in range(n_photos):
+        data = photo_pool[k % len(photo_pool)] + f'synthetic-{k}'.encode()
+        slots[k % len(slots)].append(named_upload(data, f'IMG_{k:04d}.jpg'))
+    return collected_data
+
+
+def make_text_audit(n_answers, n_phases):
+    """Audit texte de n_answers réponses réparties sur n_phases phases, avec sa structure."""
+    per_phase = max(1, n_answers // n_phases)
+    rows, collected_data = [], []
+    q_id = 1
+    for p in range(n_phases):
+        answers = {}
+        for _ in range(per_phase):
+            rows.append({'id': q_id, 'section': f'Phase {p + 1}', 'type': 'text',
+                         'question': f'Question de contrôle numéro {q_id} ?', 'obligatoire': 'Non'})
+            answers[q_id] = f'Réponse détaillée {q_id} : conforme, RAS.'
+            q_id += 1
+        collected_data.append({'phase_name': f'Phase {p + 1}', 'answers': answers})
+    return collected_data, pd.DataFrame(rows)
+
+
+def make_project_data(df_site, index=0):
+    return df_site.iloc[index].to_dict()
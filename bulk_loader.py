@@ -0,0 +1,234 @@
+# bulk_loader.py : chargement en masse des collections de référence 'formsquestions' et 'Sites'
+#
+# Usage :
+#   python bulk_loader.py questions questions.xlsx --dry-run
+#   python bulk_loader.py sites sites.csv --credentials service_account.json --workers 8
+#   python bulk_loader.py sites sites.csv --prune          # supprime aussi les sites absents du fichier
+#
+# Le fichier est validé, comparé au contenu actuel de la collection, et seuls les documents ajoutés,
+# modifiés (ou supprimés avec --prune) sont écrits, par batchs de 500 opérations validés en parallèle.
+# Sans --credentials, la connexion utilise les secrets Streamlit (.streamlit/secrets.toml).
+import argparse
+import math
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import utils
+
+BATCH_MAX_WRITES = 500  # Limite Firestore par batch
+
+COLLECTIONS = {
+    # type de chargement -> (collection, colonne clé, colonnes obligatoires)
+    'questions': ('formsquestions', 'id', ['id', 'section', 'type', 'obligatoire', 'Condition on', 'Condition value']),
+    'sites': ('Sites', 'Intitulé', list(utils.PROJECT_RENAME_MAP)),
+}
+
+# Anciens noms de champs encore présents dans les documents -> nom canonique (celui du fichier validé)
+FIELD_ALIASES = {
+    'questions': utils.FORM_COLUMN_RENAME_MAP,
+    'sites': {},
+}
+
+
+def read_table(path):
+    """Lit un fichier CSV (séparateur détecté) ou Excel en DataFrame, colonnes nettoyées."""
+    if path.lower().endswith(('.xlsx', '.xls')):
+        df = pd.read_excel(path)
+    else:
+        df = pd.read_csv(path, sep=None, engine='python', encoding='utf-8-sig')
+    df.columns = df.columns.str.strip()
+    return df
+
+
+def clean_value(value):
+    """Valeur telle qu'écrite dans Firestore : None pour les vides, entiers pour les flottants entiers."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()  # Scalaires numpy -> types Python
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        value = value.strip()
+        return value if value else None
+    return value
+
+
+def to_records(df):
+    """Une ligne par enregistrement, toutes colonnes du fichier comprises (None pour une cellule vide)."""
+    return [{k: clean_value(v) for k, v in raw.items()} for raw in df.to_dict('records')]
+
+
+def validate_questions(df):
+    errors = []
+    df = df.rename(columns={k: v for k, v in utils.FORM_COLUMN_RENAME_MAP.items() if k in df.columns})
+    missing = [c for c in COLLECTIONS['questions'][2] if c not in df.columns]
+    if missing:
+        return df, [f"Colonnes manquantes : {', '.join(missing)}"]
+
+    ids = pd.to_numeric(df['id'], errors='coerce')
+    for line in df.index[ids.isna()]:
+        errors.append(f"Ligne {line + 2} : id non numérique ({df.at[line, 'id']!r})")
+    for q_id in ids[ids.duplicated()].dropna().unique():
+        errors.append(f"id {int(q_id)} en double")
+    known_ids = set(ids.dropna().astype(int))
+
+    for line, row in df.iterrows():
+        label = f"Ligne {line + 2} (id {row['id']})"
+        if str(row['type']).strip().lower() not in utils.QUESTION_TYPES:
+            errors.append(f"{label} : type inconnu {row['type']!r} (attendu : {', '.join(sorted(utils.QUESTION_TYPES))})")
+        if str(row['obligatoire']).strip().lower() not in ('oui', 'non'):
+            errors.append(f"{label} : 'obligatoire' doit valoir Oui ou Non ({row['obligatoire']!r})")
+        condition_on = pd.to_numeric(row['Condition on'], errors='coerce')
+        if not pd.isna(condition_on) and condition_on not in (0, 1):
+            errors.append(f"{label} : 'Condition on' doit valoir 0 ou 1 ({row['Condition on']!r})")
+        if condition_on == 1:
+            condition = '' if pd.isna(row['Condition value']) else str(row['Condition value']).strip().strip('"').strip("'")
+            if not condition:
+                errors.append(f"{label} : 'Condition value' vide alors que 'Condition on' vaut 1")
+            # Même grammaire que check_condition : blocs ' OU ' d'atomes ' ET ' de la forme id=valeur
+            for atom in (a for block in condition.split(' OU ') for a in block.split(' ET ') if condition):
+                target, sep, _ = atom.partition('=')
+                if not sep or not target.strip().isdigit():
+                    errors.append(f"{label} : condition illisible {atom.strip()!r}")
+                elif int(target) not in known_ids:
+                    errors.append(f"{label} : la condition porte sur l'id {int(target)} absent du fichier")
+    return df, errors
+
+
+def validate_sites(df):
+    errors = []
+    missing = [c for c in COLLECTIONS['sites'][2] if c not in df.columns]
+    if missing:
+        return df, [f"Colonnes manquantes : {', '.join(missing)}"]
+    titles = df['Intitulé'].astype(str).str.strip()
+    for line in df.index[df['Intitulé'].isna() | (titles == '')]:
+        errors.append(f"Ligne {line + 2} : 'Intitulé' vide")
+    for title in titles[titles.duplicated()].unique():
+        errors.append(f"Intitulé en double : {title!r}")
+    # Les comptages de points de charge servent au calcul des photos attendues
+    count_cols = {c for cols in utils.SECTION_PHOTO_RULES.values() for c in cols} | {c for c in df.columns if c.startswith('Pré ')}
+    for col in sorted(count_cols & set(df.columns)):
+        values = df[col].astype(str).str.replace(',', '.').str.strip()
+        bad = df.index[df[col].notna() & (values != '') & pd.to_numeric(values, errors='coerce').isna()]
+        for line in bad:
+            errors.append(f"Ligne {line + 2} : '{col}' non numérique ({df.at[line, col]!r})")
+    return df, errors
+
+
+def document_id(kind, key):
+    return str(key) if kind == 'questions' else str(key).replace('/', '_').strip()
+
+
+def compute_diff(kind, records, current_docs, key_field, prune):
+    """Compare le fichier au contenu actuel ; retourne (écritures [(doc_id, données)], suppressions, inchangés).
+
+    Toutes les colonnes du fichier sont comparées, une cellule vide valant None : vider une cellule
+    supprime le champ du document (DELETE_FIELD, les écritures étant fusionnées). Les champs des documents
+    sont lus sous leur nom canonique (FIELD_ALIASES) ; un document qui porte encore un ancien nom est
+    réécrit et l'ancien champ supprimé, pour ne jamais garder les deux.
+    """
+    from firebase_admin import firestore
+    aliases = FIELD_ALIASES[kind]
+    current_by_key = {}
+    for doc in current_docs:
+        data = doc.to_dict() or {}
+        if key_field in data:
+            current_by_key[str(clean_value(data[key_field]))] = (doc.id, data)
+
+    writes, unchanged, seen = [], 0, set()
+    for record in records:
+        key = str(record[key_field])
+        seen.add(key)
+        existing = current_by_key.get(key)
+        if existing is None:
+            writes.append((document_id(kind, record[key_field]), {k: v for k, v in record.items() if v is not None}))
+            continue
+        doc_id, data = existing
+        old_fields = [f for f in data if f in aliases]
+        canonical = {aliases[f]: data[f] for f in old_fields}
+        canonical.update({f: v for f, v in data.items() if f not in aliases})
+        # Seules les colonnes du fichier sont comparées ; les autres champs du document sont conservés
+        if old_fields or any(clean_value(canonical.get(field)) != value for field, value in record.items()):
+            update = {
+                k: firestore.DELETE_FIELD if v is None else v
+                for k, v in record.items() if v is not None or k in canonical
+            }
+            update.update({f: firestore.DELETE_FIELD for f in old_fields})
+            writes.append((doc_id, update))
+        else:
+            unchanged += 1
+    deletes = [doc_id for key, (doc_id, _) in current_by_key.items() if key not in seen] if prune else []
+    return writes, deletes, unchanged
+
+
+def commit_in_batches(db, collection, writes, deletes, workers):
+    """Écrit par batchs pleins (BATCH_MAX_WRITES opérations), validés en parallèle."""
+    ops = [('set', doc_id, data) for doc_id, data in writes] + [('delete', doc_id, None) for doc_id in deletes]
+    chunks = [ops[i:i + BATCH_MAX_WRITES] for i in range(0, len(ops), BATCH_MAX_WRITES)]
+
+    def commit(chunk):
+        batch = db.batch()
+        for op, doc_id, data in chunk:
+            ref = db.collection(collection).document(doc_id)
+            if op == 'set': batch.set(ref, data, merge=True)
+            else: batch.delete(ref)
+        batch.commit()
+        return len(chunk)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return sum(pool.map(commit, chunks)), len(chunks)
+
+
+def connect(credentials_path):
+    if credentials_path:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        utils.set_storage_backend(firestore.client())
+    return utils.get_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chargement en masse de 'formsquestions' et 'Sites'")
+    parser.add_argument('kind', choices=sorted(COLLECTIONS), help="Collection à charger")
+    parser.add_argument('path', help="Fichier CSV ou Excel")
+    parser.add_argument('--dry-run', action='store_true', help="Affiche le différentiel sans rien écrire")
+    parser.add_argument('--prune', action='store_true', help="Supprime les documents absents du fichier")
+    parser.add_argument('--workers', type=int, default=8, help="Batchs validés en parallèle")
+    parser.add_argument('--credentials', help="Fichier JSON de compte de service (sinon secrets Streamlit)")
+    args = parser.parse_args()
+
+    collection, key_field, _ = COLLECTIONS[args.kind]
+    df = read_table(args.path)
+    df, errors = (validate_questions if args.kind == 'questions' else validate_sites)(df)
+    if errors:
+        print(f"{len(errors)} erreur(s) de validation, aucun document écrit :")
+        for err in errors[:50]: print(f"  - {err}")
+        if len(errors) > 50: print(f"  ... et {len(errors) - 50} autres")
+        return 1
+    if args.kind == 'questions':
+        df['id'] = pd.to_numeric(df['id']).astype(int)
+    records = to_records(df)
+
+    t0 = time.perf_counter()
+    db = connect(args.credentials)
+    current_docs = list(db.collection(collection).stream())
+    writes, deletes, unchanged = compute_diff(args.kind, records, current_docs, key_field, args.prune)
+    print(f"{collection} : {len(records)} lignes, {len(current_docs)} documents existants -> "
+          f"{len(writes)} à écrire, {len(deletes)} à supprimer, {unchanged} inchangés")
+
+    if args.dry_run or not (writes or deletes):
+        return 0
+    n_ops, n_batches = commit_in_batches(db, collection, writes, deletes, args.workers)
+    print(f"{n_ops} opérations en {n_batches} batch(s) en {time.perf_counter() - t0:.1f} s. "
+          "Les sessions en cours verront les données au prochain rafraîchissement du cache (1 h).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,7 @@ setup(
         'firebase-admin',
         'numpy',
         'python-docx', # Dépendance pour la génération de rapport Word
+        'Pillow', # Réduction des photos pour les exports sous budget
     ],
     # Si d'autres métadonnées sont utiles (auteur, description, etc.)
     description='Librairie de fonctions utilitaires partagées pour Streamlit.',
@@ -1,21 +1,28 @@
 
 # utils.py (Version Finale avec Styles Word Personnalisés et Gestion Photos)
 import streamlit as st
-import pandas as pd
 import uuid
-import firebase_admin
-from firebase_admin import credentials, firestore
 from datetime import datetime
-import numpy as np
 import zipfile
 from io import BytesIO
 import io
 import urllib.parse
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.style import WD_STYLE_TYPE
-from docx.enum.table import WD_ALIGN_VERTICAL
+import re
+import functools
+import csv
+import sys
+import tempfile
+import weakref
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from xml.sax.saxutils import escape as xml_escape
+# pandas, numpy, Pillow, python-docx et firebase_admin sont importés à la première utilisation,
+# dans les fonctions concernées : l'import de utils (et le démarrage d'un worker) reste léger.
 
 # --- CONSTANTES ---
 PROJECT_RENAME_MAP = {
@@ -41,11 +48,196 @@ SECTION_PHOTO_RULES = {
     "Bornes AC": ['L [Plan de Déploiement]'],
 }
 
+# Variantes de noms de colonnes rencontrées dans 'formsquestions'
+FORM_COLUMN_RENAME_MAP = {'Conditon value': 'Condition value', 'condition value': 'Condition value', 'Condition Value': 'Condition value', 'Condition': 'Condition value', 'Conditon on': 'Condition on', 'condition on': 'Condition on'}
+FORM_EXPECTED_COLUMNS = ['options', 'Description', 'Condition value', 'Condition on', 'section', 'id', 'question', 'type', 'obligatoire']
+QUESTION_TYPES = {'text', 'select', 'number', 'photo'}
+
 COMMENT_ID = 100
 COMMENT_QUESTION = "Veuillez préciser pourquoi le nombre de photo partagé ne correspond pas au minimum attendu"
 
+STATS_COLLECTION = 'SubmissionStats'
+STATS_GLOBAL_DOC = 'global'
+PHOTO_GAP_BUCKET_LIMIT = 10
+
+# Paliers (côté max en pixels, qualité JPEG) essayés pour tenir un budget de taille, du meilleur au plus compact
+IMAGE_QUALITY_LADDER = [(2400, 85), (1920, 80), (1600, 75), (1280, 70), (1024, 65), (800, 60), (640, 50), (480, 40), (320, 35)]
+THUMBNAIL_GRID_MIN_PHOTOS = 12
+THUMBNAIL_GRID_COLUMNS = 3
+THUMBNAIL_GRID_MAX_SIDE = 640
+EXPORT_BUDGET_MAX_ATTEMPTS = 3
+DEFAULT_EXPORT_BUDGET_MB = 10  # Deux pièces jointes sous la limite de 20 Mo de la passerelle email
+
+PHOTO_THUMBNAIL_SIDE = 160
+PHOTO_CHECK_WORKERS = 2
+PHOTO_CHECK_CACHE_SIZE = 2000
+PHOTO_CHECK_TIMEOUT = 30  # secondes d'attente maximale à la validation d'une phase
+EXIF_ORIENTATION_TAG = 0x0112
+
+EXPORT_WORKERS = 4  # Exports de fin d'audit (CSV, ZIP, Word) en parallèle, toutes sessions confondues
+SAVE_WORKERS = 4  # Sauvegardes Firestore, dans un pool à part pour ne jamais attendre derrière un export
+
+# Budgets mémoire (Mo) configurables par variables d'environnement
+SESSION_MEMORY_LIMIT = int(float(os.environ.get('AUDIT_SESSION_MEMORY_MB', 1024)) * 1024 * 1024)
+GLOBAL_MEMORY_LIMIT = int(float(os.environ.get('AUDIT_GLOBAL_MEMORY_MB', 4096)) * 1024 * 1024)
+MEMORY_WARNING_RATIO = 0.8
+SESSION_MEMORY_TTL = 15 * 60  # secondes sans rerun avant d'oublier une session dans le total global
+SPILL_DIR = os.environ.get('AUDIT_SPILL_DIR') or None  # None : répertoire temporaire du système
+
+# --- INSTRUMENTATION ---
+# Durées et compteurs agrégés dans le processus, activés par la variable d'environnement AUDIT_METRICS=1.
+# Désactivée, l'instrumentation se réduit à un test booléen par appel.
+
+METRICS_ENABLED = os.environ.get('AUDIT_METRICS', '').strip().lower() in ('1', 'true', 'oui', 'yes')
+METRICS_JSONL_FILE = os.environ.get('AUDIT_METRICS_FILE')  # Une ligne JSON par rerun
+METRICS_PROM_FILE = os.environ.get('AUDIT_METRICS_PROM_FILE')  # Format texte Prometheus (textfile collector)
+
+_metrics_lock = threading.Lock()
+_span_stats = {}  # nom -> [nombre, durée totale, durée max]
+_event_counts = {}  # nom -> nombre
+_rerun_local = threading.local()
+
+class _NullSpan:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_SPAN = _NullSpan()
+
+def _record_span(name, duration):
+    with _metrics_lock:
+        stats = _span_stats.get(name)
+        if stats is None: _span_stats[name] = [1, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]: stats[2] = duration
+    rerun = getattr(_rerun_local, 'record', None)
+    if rerun is not None:
+        entry = rerun.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+class _Span:
+    __slots__ = ('name', 't0')
+    def __init__(self, name): self.name = name
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        _record_span(self.name, time.perf_counter() - self.t0)
+        return False
+
+def span(name):
+    """Context manager mesurant la durée d'un bloc sous le nom donné."""
+    return _Span(name) if METRICS_ENABLED else _NULL_SPAN
+
+def timed(name):
+    """Décorateur équivalent à span() autour de chaque appel de la fonction."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED: return func(*args, **kwargs)
+            with _Span(name): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_event(name, n=1):
+    if not METRICS_ENABLED: return
+    with _metrics_lock:
+        _event_counts[name] = _event_counts.get(name, 0) + n
+
+class _RerunSpan:
+    """Mesure un rerun complet (y compris interrompu par st.rerun ou st.stop) et l'étape en cours."""
+    __slots__ = ('step', 't0')
+    def __init__(self, step): self.step = step
+    def __enter__(self):
+        _rerun_local.record = {}
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.t0
+        _record_span('rerun', duration)
+        _record_span(f'step.{self.step}', duration)
+        record = _rerun_local.record
+        _rerun_local.record = None
+        # Un échec d'export des métriques ne doit jamais remonter dans le rerun de l'utilisateur
+        try:
+            if METRICS_JSONL_FILE:
+                line = {
+                    'ts': datetime.now().isoformat(timespec='milliseconds'), 'step': self.step, 'duration_s': round(duration, 6),
+                    'interrupted': exc_type is not None and exc_type.__name__ in ('RerunException', 'StopException'),
+                    'spans': {name: {'count': c, 'total_s': round(t, 6)} for name, (c, t) in record.items()},
+                }
+                with _metrics_lock, open(METRICS_JSONL_FILE, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(line, ensure_ascii=False) + '\n')
+            if METRICS_PROM_FILE: write_prometheus_textfile(METRICS_PROM_FILE)
+        except Exception:
+            count_event('metrics.export_failed')
+        return False
+
+def rerun_span(step):
+    """Context manager englobant un rerun de app.py pour l'étape 'step'."""
+    return _RerunSpan(step) if METRICS_ENABLED else _NULL_SPAN
+
+def metrics_snapshot():
+    """Copie des agrégats : {'spans': {nom: {count, total_s, max_s}}, 'events': {nom: n}}."""
+    with _metrics_lock:
+        spans = {name: {'count': c, 'total_s': t, 'max_s': m} for name, (c, t, m) in _span_stats.items()}
+        events = dict(_event_counts)
+    return {'spans': spans, 'events': events}
+
+def reset_metrics():
+    with _metrics_lock:
+        _span_stats.clear()
+        _event_counts.clear()
+
+def metrics_prometheus_text():
+    """Agrégats au format d'exposition texte Prometheus."""
+    snap = metrics_snapshot()
+    def label(name): return name.replace('\\', '\\\\').replace('"', '\\"')
+    lines = [
+        '# HELP audit_span_seconds Durée des blocs instrumentés.',
+        '# TYPE audit_span_seconds summary',
+    ]
+    for name, st_ in sorted(snap['spans'].items()):
+        lines.append(f'audit_span_seconds_count{{name="{label(name)}"}} {st_["count"]}')
+        lines.append(f'audit_span_seconds_sum{{name="{label(name)}"}} {st_["total_s"]:.6f}')
+    lines += ['# HELP audit_span_max_seconds Durée maximale observée.', '# TYPE audit_span_max_seconds gauge']
+    for name, st_ in sorted(snap['spans'].items()):
+        lines.append(f'audit_span_max_seconds{{name="{label(name)}"}} {st_["max_s"]:.6f}')
+    lines += ['# HELP audit_events_total Compteurs d\'événements.', '# TYPE audit_events_total counter']
+    for name, n in sorted(snap['events'].items()):
+        lines.append(f'audit_events_total{{name="{label(name)}"}} {n}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus_textfile(path):
+    """Écrit les agrégats de façon atomique (fichier temporaire puis renommage).
+
+    Le fichier temporaire est propre à chaque appel : les sessions d'un même processus peuvent écrire
+    en même temps, la dernière à renommer gagne.
+    """
+    text = metrics_prometheus_text()
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)  # mkstemp crée en 0600 : le collecteur doit pouvoir le lire
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_file(tmp_path)
+        raise
+
+def write_metrics_jsonl(path):
+    """Ajoute un instantané des agrégats en une ligne JSON."""
+    line = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'pid': os.getpid(), **metrics_snapshot()}
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
 # --- INITIALISATION FIREBASE ---
+@timed('firestore.init')
 def initialize_firebase():
+    import firebase_admin
+    from firebase_admin import credentials, firestore
     if not firebase_admin._apps:
         try:
             cred_dict = {
@@ -69,50 +261,133 @@ def initialize_firebase():
             st.stop() 
     return firestore.client()
 
-db = initialize_firebase()
+_db = None
+
+def get_db():
+    """Client Firestore, initialisé au premier accès (l'import de utils reste possible hors connexion)."""
+    global _db
+    if _db is None:
+        _db = initialize_firebase()
+    return _db
+
+def set_storage_backend(backend):
+    """Remplace le client Firestore (ex. benchmarks/local_store.LocalStore pour les tests de charge). None rétablit Firestore."""
+    global _db
+    _db = backend
+    # Les données de référence en cache proviennent de l'ancien stockage
+    load_form_structure_from_firestore.clear()
+    load_site_data_from_firestore.clear()
 
 # --- CHARGEMENT DONNÉES ---
-@st.cache_data(ttl=3600)
+# 'formsquestions' et 'Sites' sont partagés par toutes les sessions du processus. Un seul chargement
+# est en vol à la fois : les sessions qui arrivent pendant ce temps l'attendent au lieu de relancer la
+# même lecture. Passé le TTL, la valeur périmée est servie immédiatement et rafraîchie en arrière-plan.
+
+REFERENCE_DATA_TTL = 3600  # secondes
+_reference_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='reference-refresh')
+
+class ReferenceCache:
+    """Cache de processus à chargement unique (single-flight) et rafraîchissement en arrière-plan.
+
+    S'utilise comme décorateur, à la place de st.cache_data, sur une fonction sans argument qui lève
+    une exception en cas d'échec (elle peut tourner hors du thread du script : aucun appel st.*).
+    Chaque appel retourne une copie ; None (aucune donnée ou échec) n'est jamais mis en cache.
+    """
+
+    def __init__(self, load, ttl, error_message):
+        functools.update_wrapper(self, load)
+        self._load, self.ttl, self.error_message = load, ttl, error_message
+        self._lock = threading.Lock()
+        self._value, self._loaded_at = None, 0.0
+        self._inflight = None  # Future du chargement en cours
+
+    def _run(self, future):
+        try:
+            value = self._load()
+        except BaseException as e:
+            count_event(f'reference.{self.__name__}.failed')
+            with self._lock: self._inflight = None
+            future.set_exception(e)  # Un rafraîchissement en échec laisse la valeur périmée en place
+            if not isinstance(e, Exception): raise
+            return
+        with self._lock:
+            if value is not None: self._value, self._loaded_at = value, time.time()
+            self._inflight = None
+        future.set_result(value)
+
+    def get(self):
+        """Valeur partagée (sans copie). Lève l'exception du chargement si aucune valeur n'est disponible."""
+        with self._lock:
+            value = self._value
+            if value is not None and time.time() - self._loaded_at < self.ttl:
+                count_event(f'reference.{self.__name__}.hit')
+                return value
+            leader = self._inflight is None
+            if leader: self._inflight = Future()
+            future = self._inflight
+        if value is not None:
+            count_event(f'reference.{self.__name__}.stale')
+            if leader: _reference_executor.submit(self._run, future)
+            return value
+        count_event(f'reference.{self.__name__}.miss' if leader else f'reference.{self.__name__}.coalesced')
+        if leader: self._run(future)
+        return future.result()
+
+    def __call__(self):
+        try:
+            value = self.get()
+        except Exception as e:
+            st.error(f"{self.error_message}: {e}")
+            return None
+        return None if value is None else value.copy()
+
+    def clear(self):
+        """Oublie la valeur : le prochain appel recharge (en attendant le chargement)."""
+        with self._lock: self._value, self._loaded_at = None, 0.0
+
+def reference_data(ttl=REFERENCE_DATA_TTL, error_message="Erreur lors du chargement"):
+    def decorator(load):
+        return ReferenceCache(load, ttl, error_message)
+    return decorator
+
+@reference_data(error_message="Erreur lors du chargement de la structure du formulaire")
+@timed('firestore.load_form_structure')
 def load_form_structure_from_firestore():
-    try:
-        docs = db.collection('formsquestions').order_by('id').get()
-        data = [doc.to_dict() for doc in docs]
-        if not data: return None
-        df = pd.DataFrame(data)
-        df.columns = df.columns.str.strip()
-        
-        rename_map = {'Conditon value': 'Condition value', 'condition value': 'Condition value', 'Condition Value': 'Condition value', 'Condition': 'Condition value', 'Conditon on': 'Condition on', 'condition on': 'Condition on'}
-        actual_rename = {k: v for k, v in rename_map.items() if k in df.columns}
-        df = df.rename(columns=actual_rename)
-        
-        expected_cols = ['options', 'Description', 'Condition value', 'Condition on', 'section', 'id', 'question', 'type', 'obligatoire']
-        for col in expected_cols:
-            if col not in df.columns: df[col] = np.nan 
-        
-        df['options'] = df['options'].fillna('')
-        df['Description'] = df['Description'].fillna('')
-        df['Condition value'] = df['Condition value'].fillna('')
-        df['Condition on'] = pd.to_numeric(df['Condition on'], errors='coerce').fillna(0).astype(int)
-        
-        for col in df.select_dtypes(include=['object']).columns:
-            df[col] = df[col].astype(str).str.strip()
-        return df
-    except Exception as e:
-        st.error(f"Erreur lors du chargement de la structure du formulaire: {e}")
-        return None
+    import pandas as pd
+    import numpy as np
+    docs = get_db().collection('formsquestions').order_by('id').get()
+    data = [doc.to_dict() for doc in docs]
+    count_event('firestore.docs_read', len(data))
+    if not data: return None
+    df = pd.DataFrame(data)
+    df.columns = df.columns.str.strip()
+    
+    actual_rename = {k: v for k, v in FORM_COLUMN_RENAME_MAP.items() if k in df.columns}
+    df = df.rename(columns=actual_rename)
+    
+    for col in FORM_EXPECTED_COLUMNS:
+        if col not in df.columns: df[col] = np.nan 
+    
+    df['options'] = df['options'].fillna('')
+    df['Description'] = df['Description'].fillna('')
+    df['Condition value'] = df['Condition value'].fillna('')
+    df['Condition on'] = pd.to_numeric(df['Condition on'], errors='coerce').fillna(0).astype(int)
+    
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].astype(str).str.strip()
+    return df
 
-@st.cache_data(ttl=3600)
+@reference_data(error_message="Erreur lors du chargement des données des sites")
+@timed('firestore.load_sites')
 def load_site_data_from_firestore():
-    try:
-        docs = db.collection('Sites').get()
-        data = [doc.to_dict() for doc in docs]
-        if not data: return None
-        df_site = pd.DataFrame(data)
-        df_site.columns = df_site.columns.str.strip()
-        return df_site
-    except Exception as e:
-        st.error(f"Erreur lors du chargement des données des sites: {e}")
-        return None
+    import pandas as pd
+    docs = get_db().collection('Sites').get()
+    data = [doc.to_dict() for doc in docs]
+    count_event('firestore.docs_read', len(data))
+    if not data: return None
+    df_site = pd.DataFrame(data)
+    df_site.columns = df_site.columns.str.strip()
+    return df_site
 
 # --- LOGIQUE MÉTIER ---
 
@@ -127,8 +402,8 @@ def get_expected_photo_count(section_name, project_data):
     for col in columns:
         val = project_data.get(col, 0)
         try:
-            if pd.isna(val) or val == "":
-                num = 0
+            if val is None or val == "":
+                num = 0  # NaN et autres valeurs non numériques sont traitées par l'exception ci-dessous
             else:
                 num = int(float(str(val).replace(',', '.'))) 
         except Exception:
@@ -155,6 +430,7 @@ def evaluate_single_condition(condition_str, all_answers):
     except Exception:
         return True
 
+@timed('condition.check')
 def check_condition(row, current_answers, collected_data):
     try:
         if int(row.get('Condition on', 0)) != 1: return True
@@ -180,35 +456,39 @@ def check_condition(row, current_answers, collected_data):
             return True
     return False
 
-def validate_section(df_questions, section_name, answers, collected_data, project_data):
-    missing = []
+def phase_photo_check(df_questions, section_name, answers, collected_data, project_data):
+    """Contrôle du nombre de photos d'une phase, tel que l'applique validate_section.
+
+    Retourne {'expected', 'received', 'has_gap', 'detail'} ; 'expected' vaut None quand aucun contrôle
+    ne s'applique (pas de règle pour la section, attendu nul ou aucune question photo visible).
+    """
     section_rows = df_questions[df_questions['section'] == section_name]
-    comment_val = answers.get(COMMENT_ID)
-    has_justification = comment_val is not None and str(comment_val).strip() != ""
-    
     expected_total_base, detail_str = get_expected_photo_count(section_name.strip(), project_data)
-    expected_total = expected_total_base
-    
-    photo_question_count = sum(
-        1 for _, row in section_rows.iterrows()
-        if str(row.get('type', '')).strip().lower() == 'photo' and check_condition(row, answers, collected_data)
-    )
-    
-    if expected_total is not None and expected_total > 0:
-        expected_total = expected_total_base * photo_question_count
-        detail_str = f"{detail_str} | Questions photo visibles: {photo_question_count} -> Total ajusté: {expected_total}"
 
-    current_photo_count = 0
-    photo_questions_found = False
-    
+    section_photo_hashes = set()
+    photo_question_count = 0
     for _, row in section_rows.iterrows():
-        q_type = str(row['type']).strip().lower()
-        if q_type == 'photo' and check_condition(row, answers, collected_data):
-            photo_questions_found = True
-            q_id = int(row['id'])
-            val = answers.get(q_id)
+        if str(row.get('type', '')).strip().lower() == 'photo' and check_condition(row, answers, collected_data):
+            photo_question_count += 1
+            val = answers.get(int(row['id']))
             if isinstance(val, list):
-                current_photo_count += len(val)
+                # Une même photo déposée plusieurs fois n'est comptée qu'une fois
+                section_photo_hashes.update(photo_content_hash(f) for f in val if hasattr(f, 'getvalue'))
+    received = len(section_photo_hashes)
+
+    if expected_total_base is None or expected_total_base <= 0 or photo_question_count == 0:
+        return {'expected': None, 'received': received, 'has_gap': False, 'detail': detail_str}
+    expected_total = expected_total_base * photo_question_count
+    detail_str = f"{detail_str} | Questions photo visibles: {photo_question_count} -> Total ajusté: {expected_total}"
+    return {'expected': expected_total, 'received': received, 'has_gap': received != expected_total, 'detail': detail_str}
+
+@timed('validate_section')
+def validate_section(df_questions, section_name, answers, collected_data, project_data):
+    missing = []
+    section_rows = df_questions[df_questions['section'] == section_name]
+    comment_val = answers.get(COMMENT_ID)
+    has_justification = comment_val is not None and str(comment_val).strip() != ""
+    photo_check = phase_photo_check(df_questions, section_name, answers, collected_data, project_data)
 
     for _, row in section_rows.iterrows():
         q_id = int(row['id'])
@@ -217,6 +497,11 @@ def validate_section(df_questions, section_name, answers, collected_data, projec
         is_mandatory = str(row['obligatoire']).strip().lower() == 'oui'
         q_type = str(row['type']).strip().lower()
         val = answers.get(q_id)
+        if q_type == 'photo' and isinstance(val, list):
+            for f_obj in val:
+                check = get_photo_check(f_obj, timeout=PHOTO_CHECK_TIMEOUT) if hasattr(f_obj, 'getvalue') else None
+                if check is not None and not check['ok']:
+                    missing.append(f"Question {q_id} : {row['question']} (image illisible « {f_obj.name} » : {check['error']})")
         if is_mandatory:
             if q_type == 'photo':
                 if not isinstance(val, list) or len(val) == 0:
@@ -228,29 +513,455 @@ def validate_section(df_questions, section_name, answers, collected_data, projec
                     missing.append(f"Question {q_id} : {row['question']}")
 
     is_photo_count_incorrect = False
-    if expected_total is not None and expected_total > 0:
-        if photo_questions_found and current_photo_count != expected_total:
-            is_photo_count_incorrect = True
-            error_message = (
-                f"⚠️ **Écart de Photos pour '{str(section_name)}'**.\n"
-                f"Attendu : **{str(expected_total)}** (calculé : {str(detail_str)}).\n"
-                f"Reçu : **{str(current_photo_count)}**.\n"
+    if photo_check['has_gap']:
+        is_photo_count_incorrect = True
+        error_message = (
+            f"⚠️ **Écart de Photos pour '{str(section_name)}'**.\n"
+            f"Attendu : **{str(photo_check['expected'])}** (calculé : {str(photo_check['detail'])}).\n"
+            f"Reçu : **{str(photo_check['received'])}**.\n"
+        )
+        if not has_justification:
+            missing.append(
+                f"**Commentaire (ID {COMMENT_ID}) :** {COMMENT_QUESTION} "
+                f"(requis en raison de l'écart de photo). \n\n {error_message}"
             )
-            if not has_justification:
-                missing.append(
-                    f"**Commentaire (ID {COMMENT_ID}) :** {COMMENT_QUESTION} "
-                    f"(requis en raison de l'écart de photo). \n\n {error_message}"
-                )
 
     if not is_photo_count_incorrect and COMMENT_ID in answers:
         del answers[COMMENT_ID]
 
     return len(missing) == 0, missing
 
+# --- PHOTOS : DÉDOUBLONNAGE PAR CONTENU ---
+# Chaque image déposée est identifiée par l'empreinte SHA-256 de son contenu. Le magasin de session
+# conserve un seul objet par empreinte, référencé par toutes les réponses qui contiennent cette image.
+
+def photo_content_hash(f_obj):
+    """Empreinte SHA-256 du contenu d'un fichier, mémorisée sur l'objet."""
+    h = getattr(f_obj, 'content_hash', None)
+    if h is None:
+        h = hashlib.sha256(f_obj.getvalue()).hexdigest()
+        try: f_obj.content_hash = h
+        except AttributeError: pass
+    return h
+
+class PhotoStore:
+    """Magasin de photos d'une session : une instance de fichier par contenu distinct."""
+
+    def __init__(self):
+        self.by_hash = {}
+        self._hash_by_file_id = {}
+
+    def _hash_of(self, f_obj):
+        # Les objets UploadedFile sont recréés à chaque rerun : l'empreinte est retrouvée par file_id
+        file_id = getattr(f_obj, 'file_id', None)
+        if file_id is None: return photo_content_hash(f_obj)
+        h = self._hash_by_file_id.get(file_id)
+        if h is None:
+            h = photo_content_hash(f_obj)
+            self._hash_by_file_id[file_id] = h
+        return h
+
+    def register(self, files):
+        """Enregistre les fichiers déposés et retourne la liste des instances uniques correspondantes."""
+        canonical = []
+        for f_obj in files:
+            h = self._hash_of(f_obj)
+            stored = self.by_hash.get(h)
+            if stored is None:
+                stored = self.by_hash[h] = f_obj
+                try: stored.content_hash = h
+                except AttributeError: pass
+                submit_photo_check(stored)
+            canonical.append(stored)
+        return canonical
+
+    def prune(self, *answer_sets):
+        """Oublie les photos qui ne sont plus référencées par aucune des réponses fournies."""
+        referenced = {
+            photo_content_hash(f_obj)
+            for answers in answer_sets
+            for val in answers.values()
+            for f_obj in (val if isinstance(val, list) else [val])
+            if hasattr(f_obj, 'getvalue')
+        }
+        self.by_hash = {h: f for h, f in self.by_hash.items() if h in referenced}
+        self._hash_by_file_id = {k: h for k, h in self._hash_by_file_id.items() if h in referenced}
+
+def photo_size(f_obj):
+    size = getattr(f_obj, 'size', None)
+    return size if size is not None else f_obj.getbuffer().nbytes
+
+def get_photo_store():
+    if 'photo_store' not in st.session_state:
+        st.session_state['photo_store'] = PhotoStore()
+    return st.session_state['photo_store']
+
+def prune_photo_store(collected_data, current_answers):
+    get_photo_store().prune(current_answers, *(phase['answers'] for phase in collected_data))
+
+def find_duplicate_photos(answers, collected_data, phase_name):
+    """Messages signalant les photos de la phase en cours déjà déposées ailleurs dans l'audit."""
+    first_seen = {}
+    for phase in collected_data:
+        for q_id, val in phase['answers'].items():
+            if not isinstance(val, list): continue
+            for idx, f_obj in enumerate(val):
+                if hasattr(f_obj, 'getvalue'):
+                    first_seen.setdefault(photo_content_hash(f_obj), f"{phase['phase_name']} / Q{q_id} (photo {idx+1})")
+
+    messages = []
+    for q_id, val in answers.items():
+        if not isinstance(val, list): continue
+        for idx, f_obj in enumerate(val):
+            if not hasattr(f_obj, 'getvalue'): continue
+            h = photo_content_hash(f_obj)
+            location = f"{phase_name} / Q{q_id} (photo {idx+1})"
+            if h in first_seen:
+                messages.append(f"Photo « {f_obj.name} » ({location}) : identique à {first_seen[h]}")
+            else:
+                first_seen[h] = location
+    return messages
+
+# --- PHOTOS : VALIDATION ET VIGNETTES ---
+# Chaque image distincte est décodée une seule fois, en arrière-plan, dès son dépôt : validation,
+# redressement selon l'orientation EXIF et vignette JPEG mise en cache pour l'aperçu dans le formulaire.
+
+_photo_executor = ThreadPoolExecutor(max_workers=PHOTO_CHECK_WORKERS, thread_name_prefix='photo-check')
+_photo_checks = OrderedDict()  # empreinte -> Future du résultat de _check_photo
+_photo_checks_lock = threading.Lock()
+
+@timed('photo.check')
+def _check_photo(f_obj):
+    """Décode l'image ; retourne {'ok', 'error', 'width', 'height', 'thumbnail', 'orientation'}."""
+    from PIL import Image, ImageOps
+    try:
+        data = f_obj.getvalue()
+        with Image.open(BytesIO(data)) as img:
+            img.verify()  # Détecte les fichiers tronqués ou corrompus
+        with Image.open(BytesIO(data)) as img:
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+            width, height = img.size
+            img.thumbnail((PHOTO_THUMBNAIL_SIDE, PHOTO_THUMBNAIL_SIDE))
+            thumb = BytesIO()
+            img.save(thumb, 'JPEG', quality=70)
+        return {'ok': True, 'error': None, 'width': width, 'height': height, 'thumbnail': thumb.getvalue(), 'orientation': orientation}
+    except Exception as e:
+        return {'ok': False, 'error': str(e) or type(e).__name__, 'width': None, 'height': None, 'thumbnail': None, 'orientation': 1}
+
+def submit_photo_check(f_obj):
+    """Lance (une seule fois par contenu) l'analyse de l'image et retourne son Future."""
+    h = photo_content_hash(f_obj)
+    with _photo_checks_lock:
+        future = _photo_checks.get(h)
+        if future is None:
+            future = _photo_executor.submit(_check_photo, f_obj)
+            _photo_checks[h] = future
+            while len(_photo_checks) > PHOTO_CHECK_CACHE_SIZE:
+                _photo_checks.popitem(last=False)
+        else:
+            _photo_checks.move_to_end(h)
+    return future
+
+def get_photo_check(f_obj, timeout=0):
+    """Résultat de l'analyse, ou None s'il n'est pas disponible dans le délai (0 : sans attendre)."""
+    future = submit_photo_check(f_obj)
+    if timeout == 0 and not future.done(): return None
+    try: return future.result(timeout=timeout)
+    except FutureTimeoutError: return None
+
+def photo_bytes(f_obj):
+    """Contenu à exporter : version redressée si l'image en a une, sinon le fichier d'origine.
+
+    Word n'applique pas l'orientation EXIF. La version redressée est calculée à la demande et conservée
+    sur l'objet (mémoire de la session, comptée dans son budget).
+    """
+    normalized = getattr(f_obj, 'normalized_bytes', None)
+    if normalized is not None: return normalized
+    data = f_obj.getvalue()
+    check = get_photo_check(f_obj, timeout=PHOTO_CHECK_TIMEOUT)
+    if not check or check['orientation'] == 1: return data
+    # L'analyse porte sur le contenu d'origine : un tampon dérivé (photo réduite, déjà redressée)
+    # partage son empreinte, son orientation est donc relue sur ses propres octets
+    try: normalized = _exif_normalized(data)
+    except Exception: return data
+    if normalized is None: return data
+    try: f_obj.normalized_bytes = normalized
+    except AttributeError: pass
+    return normalized
+
+def _exif_normalized(data):
+    """JPEG redressé selon l'orientation EXIF, ou None si l'image est déjà droite."""
+    from PIL import Image, ImageOps
+    with Image.open(BytesIO(data)) as img:
+        if img.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1: return None
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=90)
+        return out.getvalue()
+
+def render_photo_previews(files):
+    """Aperçu des vignettes déposées pour une question, avec les erreurs de décodage."""
+    thumbs, captions = [], []
+    for f_obj in files:
+        check = get_photo_check(f_obj)
+        if check is None:
+            st.caption(f"⏳ Analyse de « {f_obj.name} » en cours...")
+        elif not check['ok']:
+            st.error(f"Image illisible « {f_obj.name} » : {check['error']}. Veuillez la remplacer.")
+        else:
+            thumbs.append(check['thumbnail'])
+            captions.append(f_obj.name)
+    if thumbs: st.image(thumbs, caption=captions, width=PHOTO_THUMBNAIL_SIDE)
+
+# --- MÉMOIRE PAR SESSION ---
+# Comptabilise les octets retenus par chaque session (photos, réponses, exports en cache) face à un
+# budget par session et un budget global au processus. Sous pression : les exports (régénérables)
+# sont évincés d'abord, puis les photos des phases validées sont déchargées sur disque.
+
+def _remove_file(path):
+    try: os.remove(path)
+    except OSError: pass
+
+class SpilledPhoto:
+    """Photo déchargée sur disque, lisible comme un UploadedFile (read, seek, getvalue, name)."""
+
+    def __init__(self, f_obj, directory=None):
+        data = photo_bytes(f_obj)
+        fd, self.path = tempfile.mkstemp(prefix='audit_photo_', suffix='.img', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self.name = f_obj.name
+        self.size = len(data)
+        self.content_hash = photo_content_hash(f_obj)
+        self._pos = 0
+        weakref.finalize(self, _remove_file, self.path)
+
+    def getvalue(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def getbuffer(self):
+        return memoryview(self.getvalue())
+
+    def read(self, size=-1):
+        with open(self.path, 'rb') as f:
+            f.seek(self._pos)
+            data = f.read() if size is None or size < 0 else f.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, pos, whence=0):
+        self._pos = pos if whence == 0 else (self._pos + pos if whence == 1 else self.size + pos)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+_session_memory = {}  # identifiant de session -> (octets, horodatage)
+_session_memory_lock = threading.Lock()
+
+def _forget_session_usage(key):
+    with _session_memory_lock:
+        _session_memory.pop(key, None)
+
+class _SessionMemoryToken:
+    """Rangé dans l'état de session : quand Streamlit libère la session, sa consommation est oubliée."""
+    __slots__ = ('key', '__weakref__')
+
+    def __init__(self):
+        self.key = uuid.uuid4().hex
+        weakref.finalize(self, _forget_session_usage, self.key)
+
+def _session_key(state):
+    token = state.get('_memory_session_token')
+    if token is None:
+        token = state['_memory_session_token'] = _SessionMemoryToken()
+    return token.key
+
+def _iter_session_photos(state):
+    answer_sets = [phase['answers'] for phase in state.get('collected_data') or []]
+    answer_sets.append(state.get('current_phase_temp') or {})
+    for answers in answer_sets:
+        for val in answers.values():
+            for f_obj in (val if isinstance(val, list) else [val]):
+                if hasattr(f_obj, 'getvalue'): yield f_obj
+
+def session_memory_usage(state):
+    """Octets retenus par la session : {'photos', 'answers', 'exports', 'spilled', 'total'}."""
+    photos, spilled, seen = 0, 0, set()
+    for f_obj in _iter_session_photos(state):
+        h = photo_content_hash(f_obj)
+        if h in seen: continue
+        seen.add(h)
+        if isinstance(f_obj, SpilledPhoto):
+            spilled += f_obj.size
+        else:
+            photos += photo_size(f_obj) + len(getattr(f_obj, 'normalized_bytes', None) or b'')
+
+    answers = 0
+    for phase in (state.get('collected_data') or []) + [{'answers': state.get('current_phase_temp') or {}}]:
+        for val in phase['answers'].values():
+            if not isinstance(val, list) and not hasattr(val, 'read'):
+                answers += sys.getsizeof(val)
+
+    exports = 0
+    for entry in (state.get('export_cache') or {}).values():
+        value = entry['value'][0] if isinstance(entry['value'], tuple) else entry['value']
+        exports += value.getbuffer().nbytes if hasattr(value, 'getbuffer') else len(value)
+
+    return {'photos': photos, 'answers': answers, 'exports': exports, 'spilled': spilled, 'total': photos + answers + exports}
+
+def _record_session_usage(key, total):
+    """Met à jour la consommation de la session ; retourne {session: octets} pour tout le processus."""
+    now = time.time()
+    with _session_memory_lock:
+        _session_memory[key] = (total, now)
+        for stale in [k for k, (_, ts) in _session_memory.items() if now - ts > SESSION_MEMORY_TTL]:
+            del _session_memory[stale]  # Onglets fermés ou inactifs
+        return {k: n for k, (n, _) in _session_memory.items()}
+
+def _global_excess_share(key, usages):
+    """Part du dépassement du budget global imputée à la session : les plus grosses libèrent en premier."""
+    remaining = sum(usages.values()) - GLOBAL_MEMORY_LIMIT
+    for k, n in sorted(usages.items(), key=lambda item: item[1], reverse=True):
+        if remaining <= 0: break
+        if k == key: return min(n, remaining)
+        remaining -= n
+    return 0
+
+def release_session_memory(state):
+    token = state.get('_memory_session_token')
+    if token is not None: _forget_session_usage(token.key)
+
+def cached_export(state, name, key, build):
+    """Export mis en cache dans la session ; reconstruit si la clé change ou s'il a été évincé."""
+    cache = state.setdefault('export_cache', {})
+    entry = cache.get(name)
+    if entry is None or entry['key'] != key:
+        entry = cache[name] = {'key': key, 'value': build()}
+    return entry['value']
+
+# Fin d'audit : sauvegarde et exports tournent en arrière-plan, dans deux pools distincts. Les futures
+# vivent dans la session pour qu'un rerun (clic sur un téléchargement) retrouve les travaux en cours au
+# lieu de les relancer. Les fonctions soumises ne doivent pas appeler st.* : elles reçoivent leurs données
+# en arguments.
+_export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export')
+_save_executor = ThreadPoolExecutor(max_workers=SAVE_WORKERS, thread_name_prefix='save')
+
+def run_in_background(state, name, key, build, executor=None):
+    """Future de build(), lancé une seule fois par (nom, clé) pour la session.
+
+    Une nouvelle clé remplace la tâche précédente, annulée si elle n'a pas encore démarré : une session
+    qui change de paramètre en rafale garde au plus une tâche en cours et une en attente par nom.
+    """
+    tasks = state.setdefault('background_tasks', {})
+    task = tasks.get(name)
+    if task is None or task[0] != key:
+        if task is not None: task[1].cancel()
+        task = tasks[name] = (key, (executor or _export_executor).submit(build))
+    return task[1]
+
+def submit_save(state, submission_id, build):
+    """Future de la sauvegarde de fin d'audit, hors du pool des exports."""
+    return run_in_background(state, 'save', submission_id, build, _save_executor)
+
+def forget_background(state, name):
+    (state.get('background_tasks') or {}).pop(name, None)
+
+def submit_export(state, name, key, build):
+    """Comme cached_export, mais retourne un Future : déjà résolu si l'export est en cache."""
+    entry = (state.get('export_cache') or {}).get(name)
+    if entry is not None and entry['key'] == key:
+        done = Future()
+        done.set_result(entry['value'])
+        return done
+    return run_in_background(state, f'export.{name}', key, build)
+
+def collect_export(state, name, key, future):
+    """Résultat d'un export soumis, rangé dans le cache de la session (et donc dans son budget mémoire)."""
+    try:
+        value = future.result()
+    finally:
+        forget_background(state, f'export.{name}')  # En cas d'échec, le prochain rerun relance l'export
+    state.setdefault('export_cache', {})[name] = {'key': key, 'value': value}
+    return value
+
+def spill_session_photos(state, bytes_to_free):
+    """Décharge sur disque les plus grosses photos des phases validées ; retourne les octets libérés."""
+    store = state.get('photo_store')
+    candidates = {}
+    for phase in state.get('collected_data') or []:
+        for val in phase['answers'].values():
+            for f_obj in (val if isinstance(val, list) else [val]):
+                if hasattr(f_obj, 'getvalue') and not isinstance(f_obj, SpilledPhoto):
+                    candidates.setdefault(photo_content_hash(f_obj), f_obj)
+
+    spilled, freed = {}, 0
+    for h, f_obj in sorted(candidates.items(), key=lambda item: photo_size(item[1]), reverse=True):
+        if freed >= bytes_to_free: break
+        freed += photo_size(f_obj) + len(getattr(f_obj, 'normalized_bytes', None) or b'')
+        spilled[h] = SpilledPhoto(f_obj, SPILL_DIR)
+
+    if spilled:
+        for phase in state['collected_data']:
+            for q_id, val in phase['answers'].items():
+                if isinstance(val, list):
+                    phase['answers'][q_id] = [spilled.get(photo_content_hash(f), f) if hasattr(f, 'getvalue') else f for f in val]
+                elif hasattr(val, 'getvalue'):
+                    phase['answers'][q_id] = spilled.get(photo_content_hash(val), val)
+        if store is not None:
+            for h, spilled_photo in spilled.items():
+                if h in store.by_hash: store.by_hash[h] = spilled_photo
+    return freed
+
+def enforce_memory_budget(state):
+    """Applique les budgets mémoire à la session et retourne l'état de sa consommation.
+
+    Retourne {'usage', 'limit', 'ratio', 'global_total', 'global_limit', 'actions', 'warning'}.
+    """
+    key = _session_key(state)
+    usage = session_memory_usage(state)
+    actions = []
+
+    def excess():
+        # Dépassement propre à la session, ou sa part du dépassement global ; jamais plus que ce qu'elle retient
+        usages = _record_session_usage(key, usage['total'])
+        own = max(usage['total'] - SESSION_MEMORY_LIMIT, 0)
+        return min(max(own, _global_excess_share(key, usages)), usage['total']), sum(usages.values())
+
+    over, global_total = excess()
+    # À l'étape FINISHED, les exports sont les fichiers en cours de téléchargement : les évincer ne ferait
+    # que les reconstruire dans le même rerun. Seules les photos sont alors déchargées.
+    if over and usage['exports'] and state.get('step') != 'FINISHED':
+        state['export_cache'] = {}
+        actions.append('exports')
+        usage = session_memory_usage(state)
+        over, global_total = excess()
+    if over:
+        # Marge (proportionnelle à la session) pour ne pas décharger à nouveau au rerun suivant
+        margin = int(min(usage['total'], SESSION_MEMORY_LIMIT) * (1 - MEMORY_WARNING_RATIO))
+        if spill_session_photos(state, min(over + margin, usage['total'])):
+            actions.append('spill')
+            usage = session_memory_usage(state)
+            over, global_total = excess()
+
+    ratio = usage['total'] / SESSION_MEMORY_LIMIT if SESSION_MEMORY_LIMIT else 0.0
+    return {
+        'usage': usage, 'limit': SESSION_MEMORY_LIMIT, 'ratio': ratio,
+        'global_total': global_total, 'global_limit': GLOBAL_MEMORY_LIMIT,
+        'actions': actions, 'warning': ratio >= MEMORY_WARNING_RATIO or bool(actions),
+    }
+
 # --- SAUVEGARDE ET EXPORTS ---
 
 def define_custom_styles(doc):
     """Définit et configure les trois styles de mise en forme."""
+    from docx.shared import Pt, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.enum.style import WD_STYLE_TYPE
     # 1. Report Title
     try: title_style = doc.styles.add_style('Report Title', WD_STYLE_TYPE.PARAGRAPH)
     except: title_style = doc.styles['Report Title']
@@ -275,12 +986,8 @@ def define_custom_styles(doc):
     text_font.name, text_font.size = 'Calibri', Pt(11)
     text_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
 
-def create_word_report(collected_data, df_struct, project_data, form_start_time):
-    """Génère le rapport Word complet avec styles et photos."""
-    doc = Document()
-    define_custom_styles(doc)
-    
-    # En-tête
+def _write_report_header(doc, project_data, form_start_time):
+    """En-tête du rapport : titre, informations et détails du projet."""
     doc.add_paragraph('Rapport d\'Audit Chantier', style='Report Title')
 
     # Informations Projet
@@ -310,6 +1017,19 @@ def create_word_report(collected_data, df_struct, project_data, form_start_time)
             p = doc.add_paragraph(style='Report Text')
             p.add_run(f'{renamed_key}: ').bold = True
             p.add_run(str(value))
+
+@timed('export.word')
+def create_word_report(collected_data, df_struct, project_data, form_start_time):
+    """Génère le rapport Word complet avec styles et photos."""
+    from docx import Document
+    from docx.shared import Inches, Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.enum.table import WD_ALIGN_VERTICAL
+    doc = Document()
+    define_custom_styles(doc)
+    
+    # En-tête
+    _write_report_header(doc, project_data, form_start_time)
     
     doc.add_page_break()
     
@@ -361,6 +1081,285 @@ def create_word_report(collected_data, df_struct, project_data, form_start_time)
     buf.seek(0)
     return buf
 
+# --- RENDU WORD RAPIDE ---
+# Le modèle stylé est construit une seule fois par processus ; les réponses texte de chaque phase
+# sont écrites en un seul tableau, construit directement en XML plutôt que cellule par cellule.
+
+_XML_INVALID_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+@functools.lru_cache(maxsize=1)
+def _report_template():
+    """Retourne (octets du modèle .docx stylé, identifiants de styles, largeur de colonne en twips)."""
+    from docx import Document
+    doc = Document()
+    define_custom_styles(doc)
+    section = doc.sections[0]
+    col_width = int((section.page_width - section.left_margin - section.right_margin) / 2 / 635)
+    style_ids = {
+        'table': doc.styles['Light Grid Accent 1'].style_id,
+        'text': doc.styles['Report Text'].style_id,
+    }
+    buf = BytesIO()
+    doc.save(buf)
+    return buf.getvalue(), style_ids, col_width
+
+def build_question_index(df_struct):
+    """Dictionnaire id de question -> texte, construit une fois par export."""
+    import pandas as pd
+    ids = pd.to_numeric(df_struct['id'], errors='coerce')
+    index = {int(i): q for i, q in zip(ids, df_struct['question']) if not pd.isna(i)}
+    index[COMMENT_ID] = COMMENT_QUESTION
+    return index
+
+def _cell_xml(text, width, bold, text_style_id):
+    text = _XML_INVALID_CHARS.sub('', str(text))
+    r_pr = '<w:rPr><w:b/></w:rPr>' if bold else ''
+    parts = '<w:br/>'.join(f'<w:t xml:space="preserve">{xml_escape(line)}</w:t>' for line in text.split('\n'))
+    return (
+        f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/><w:vAlign w:val="center"/></w:tcPr>'
+        f'<w:p><w:pPr><w:pStyle w:val="{text_style_id}"/></w:pPr><w:r>{r_pr}{parts}</w:r></w:p></w:tc>'
+    )
+
+def _answers_table_xml(rows, style_ids, col_width):
+    """Tableau WordprocessingML à deux colonnes (question, réponse) pour une série de réponses."""
+    from docx.oxml.ns import nsdecls
+    body = ''.join(
+        f'<w:tr>{_cell_xml(q, col_width, True, style_ids["text"])}{_cell_xml(a, col_width, False, style_ids["text"])}</w:tr>'
+        for q, a in rows
+    )
+    return (
+        f'<w:tbl {nsdecls("w")}><w:tblPr><w:tblStyle w:val="{style_ids["table"]}"/><w:tblW w:w="0" w:type="auto"/>'
+        '<w:tblLook w:val="0080" w:firstRow="0" w:lastRow="0" w:firstColumn="1" w:lastColumn="0" w:noHBand="0" w:noVBand="1"/>'
+        f'</w:tblPr><w:tblGrid><w:gridCol w:w="{col_width}"/><w:gridCol w:w="{col_width}"/></w:tblGrid>{body}</w:tbl>'
+    )
+
+def _append_block(doc, element):
+    body = doc.element.body
+    sect_pr = body.sectPr
+    if sect_pr is not None: sect_pr.addprevious(element)
+    else: body.append(element)
+
+def _add_photos(doc, photos, embedded, location):
+    """Photos pleine largeur, chacune suivie de sa légende. Une photo déjà insérée est seulement référencée."""
+    from docx.shared import Inches, Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    for idx, f_obj in enumerate(photos):
+        try:
+            h = photo_content_hash(f_obj)
+            duplicate_of = embedded.get(h)
+            if duplicate_of is None:
+                doc.add_picture(BytesIO(photo_bytes(f_obj)), width=Inches(5))
+                embedded[h] = f"{location}, photo {idx+1}"
+                caption = f'Photo {idx+1}: {f_obj.name}'
+            else:
+                caption = f'Photo {idx+1}: {f_obj.name} (identique à {duplicate_of})'
+            cap = doc.add_paragraph(caption, style='Report Text')
+            cap.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            if cap.runs:
+                cap.runs[0].font.size, cap.runs[0].font.italic = Pt(9), True
+        except Exception: doc.add_paragraph(f"[Erreur Photo {idx+1}]", style='Report Text')
+
+def _add_photo_grid(doc, photos, embedded, location):
+    """Planche de vignettes (THUMBNAIL_GRID_COLUMNS par ligne) pour les sections très illustrées."""
+    from docx.shared import Inches, Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    n_rows = -(-len(photos) // THUMBNAIL_GRID_COLUMNS)
+    grid = doc.add_table(rows=n_rows, cols=THUMBNAIL_GRID_COLUMNS)
+    for idx, f_obj in enumerate(photos):
+        cell = grid.cell(idx // THUMBNAIL_GRID_COLUMNS, idx % THUMBNAIL_GRID_COLUMNS)
+        p = cell.paragraphs[0]
+        p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        try:
+            h = photo_content_hash(f_obj)
+            duplicate_of = embedded.get(h)
+            if duplicate_of is None:
+                p.add_run().add_picture(BytesIO(photo_bytes(f_obj)), width=Inches(1.9))
+                embedded[h] = f"{location}, photo {idx+1}"
+                cap = p.add_run(f'\nPhoto {idx+1}')
+            else:
+                cap = p.add_run(f'Photo {idx+1} : identique à {duplicate_of}')
+        except Exception:
+            cap = p.add_run(f'[Erreur Photo {idx+1}]')
+        cap.font.size, cap.font.italic = Pt(8), True
+
+@timed('export.word_fast')
+def create_word_report_fast(collected_data, df_struct, project_data, form_start_time, thumbnail_grid_min_photos=None):
+    """Variante rapide de create_word_report : même contenu, modèle pré-stylé et tableaux écrits en bloc.
+
+    Si thumbnail_grid_min_photos est renseigné, les phases comptant au moins ce nombre de photos
+    sont rendues en planches de vignettes plutôt qu'en photos pleine largeur.
+    """
+    from docx import Document
+    from docx.oxml import parse_xml
+    template_bytes, style_ids, col_width = _report_template()
+    doc = Document(BytesIO(template_bytes))
+    question_index = build_question_index(df_struct)
+
+    _write_report_header(doc, project_data, form_start_time)
+    
+    doc.add_page_break()
+
+    embedded = {}  # empreinte -> emplacement de la première insertion
+    pending_rows = []
+    def flush_rows():
+        if pending_rows:
+            _append_block(doc, parse_xml(_answers_table_xml(pending_rows, style_ids, col_width)))
+            doc.add_paragraph()
+            pending_rows.clear()
+
+    for phase_idx, phase in enumerate(collected_data):
+        doc.add_paragraph(f'Phase: {phase["phase_name"]}', style='Report Subtitle')
+        use_grid = bool(thumbnail_grid_min_photos) and count_phase_photos(phase) >= thumbnail_grid_min_photos
+
+        for q_id, answer in phase['answers'].items():
+            q_text = question_index.get(int(q_id), f"ID {q_id}")
+            is_photo = (isinstance(answer, list) and answer and hasattr(answer[0], 'read')) or hasattr(answer, 'read')
+
+            if not is_photo:
+                # Les réponses texte consécutives partagent un seul tableau
+                pending_rows.append((f'Q{q_id}: {q_text}', answer))
+                continue
+
+            flush_rows()
+            doc.add_paragraph(f'Q{q_id}: {q_text}', style='Report Subtitle')
+            photos = answer if isinstance(answer, list) else [answer]
+            location = f'{phase["phase_name"]} Q{q_id}'
+            if use_grid: _add_photo_grid(doc, photos, embedded, location)
+            else: _add_photos(doc, photos, embedded, location)
+            doc.add_paragraph()
+
+        flush_rows()
+        if phase_idx < len(collected_data) - 1: doc.add_page_break()
+
+    buf = BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    return buf
+
+# --- EXPORTS SOUS BUDGET DE TAILLE ---
+# Chaque photo est réencodée en JPEG au palier (résolution, qualité) le plus élevé qui tient dans
+# sa part du budget ; les petites photos libèrent leur reste au profit des plus lourdes.
+
+def count_phase_photos(phase):
+    return sum(
+        len(v) if isinstance(v, list) else 1
+        for v in phase['answers'].values()
+        if (isinstance(v, list) and v and hasattr(v[0], 'read')) or hasattr(v, 'read')
+    )
+
+def compress_image(data, max_side, quality):
+    """Réencode une image en JPEG, côté le plus long limité à max_side."""
+    from PIL import Image, ImageOps
+    with Image.open(BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+        img.thumbnail((max_side, max_side))
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True)
+        return out.getvalue()
+
+def fit_image_to_budget(data, target_bytes, max_side_cap=None):
+    """Meilleur palier de IMAGE_QUALITY_LADDER tenant dans target_bytes (le plus bas sinon)."""
+    if len(data) <= target_bytes and max_side_cap is None:
+        return data
+    ladder = [(min(side, max_side_cap or side), q) for side, q in IMAGE_QUALITY_LADDER]
+    # Recherche dichotomique : la taille décroît le long de l'échelle
+    lo, hi, best = 0, len(ladder) - 1, None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = compress_image(data, *ladder[mid])
+        if len(candidate) <= target_bytes:
+            best, hi = candidate, mid - 1
+        else:
+            lo = mid + 1
+    if best is None:
+        best = compress_image(data, *ladder[-1])
+    return best if len(best) < len(data) else data
+
+def _named_buffer(data, name):
+    buf = BytesIO(data)
+    buf.name = name
+    return buf
+
+def shrink_photos_to_budget(collected_data, photo_budget_bytes, thumbnail_grid_min_photos=None):
+    """Copie de collected_data dont les photos tiennent ensemble dans photo_budget_bytes.
+
+    Retourne (données réduites, taille totale des photos d'origine, taille totale après réduction).
+    """
+    photo_refs = {}
+    shrunk_data = []
+    for phase in collected_data:
+        grid_cap = THUMBNAIL_GRID_MAX_SIDE if thumbnail_grid_min_photos and count_phase_photos(phase) >= thumbnail_grid_min_photos else None
+        new_answers = {}
+        for q_id, answer in phase['answers'].items():
+            is_photo = (isinstance(answer, list) and answer and hasattr(answer[0], 'read')) or hasattr(answer, 'read')
+            if not is_photo:
+                new_answers[q_id] = answer
+                continue
+            slots = []
+            for f_obj in (answer if isinstance(answer, list) else [answer]):
+                slots.append(None)
+                h = photo_content_hash(f_obj)
+                ref = photo_refs.setdefault(h, {'file': f_obj, 'grid_cap': grid_cap, 'slots': []})
+                if grid_cap is None: ref['grid_cap'] = None  # Une occurrence pleine largeur garde la pleine résolution
+                ref['slots'].append((slots, len(slots) - 1))
+            new_answers[q_id] = slots
+        shrunk_data.append({"phase_name": phase["phase_name"], "answers": new_answers})
+
+    # Chaque contenu distinct n'est réduit (et compté dans le budget) qu'une seule fois
+    original_total, final_total = 0, 0
+    remaining_budget, remaining_count = photo_budget_bytes, len(photo_refs)
+    for h, ref in sorted(photo_refs.items(), key=lambda item: photo_size(item[1]['file'])):
+        data = photo_bytes(ref['file'])
+        target = max(remaining_budget // remaining_count, 1)
+        try:
+            fitted = fit_image_to_budget(data, target, ref['grid_cap'])
+        except Exception:
+            fitted = data  # Image illisible : conservée telle quelle, signalée à l'export
+        shrunk = _named_buffer(fitted, ref['file'].name)
+        shrunk.content_hash = h
+        for slots, pos in ref['slots']: slots[pos] = shrunk
+        original_total += len(data)
+        final_total += len(fitted)
+        remaining_budget -= len(fitted)
+        remaining_count -= 1
+    return shrunk_data, original_total, final_total
+
+def _build_within_budget(build, collected_data, budget_bytes, overhead_estimate, thumbnail_grid_min_photos=None):
+    """Construit un export sous budget, en réajustant la part des photos si la première estimation déborde."""
+    photo_budget = budget_bytes - overhead_estimate
+    for _ in range(EXPORT_BUDGET_MAX_ATTEMPTS):
+        shrunk, original_total, final_total = shrink_photos_to_budget(collected_data, max(photo_budget, 1), thumbnail_grid_min_photos)
+        buf = build(shrunk)
+        size = buf.getbuffer().nbytes
+        overhead = max(size - final_total, 0)
+        if size <= budget_bytes: break
+        photo_budget = int((budget_bytes - overhead) * 0.97)
+    report = {
+        'size': size,
+        'budget': budget_bytes,
+        'within_budget': size <= budget_bytes,
+        'original_size': original_total + overhead,
+        'compression_ratio': (original_total + overhead) / size if size else 1.0,
+    }
+    return buf, report
+
+@timed('export.word_budget')
+def create_word_report_within_budget(collected_data, df_struct, project_data, form_start_time, budget_bytes, thumbnail_grid_min_photos=THUMBNAIL_GRID_MIN_PHOTOS):
+    """Rapport Word dont la taille vise budget_bytes. Retourne (buffer, rapport de taille)."""
+    n_photos = sum(count_phase_photos(phase) for phase in collected_data)
+    overhead_estimate = 64 * 1024 + 2 * 1024 * n_photos
+    return _build_within_budget(
+        lambda data: create_word_report_fast(data, df_struct, project_data, form_start_time, thumbnail_grid_min_photos),
+        collected_data, budget_bytes, overhead_estimate, thumbnail_grid_min_photos,
+    )
+
+@timed('export.zip_budget')
+def create_zip_export_within_budget(collected_data, budget_bytes):
+    """Archive photos dont la taille vise budget_bytes. Retourne (buffer, rapport de taille)."""
+    n_photos = sum(count_phase_photos(phase) for phase in collected_data)
+    return _build_within_budget(create_zip_export, collected_data, budget_bytes, 1024 + 256 * n_photos)
+
 def save_form_data(collected_data, project_data, submission_id, start_time):
     try:
         cleaned_data = []
@@ -387,34 +1386,442 @@ def save_form_data(collected_data, project_data, submission_id, start_time):
         }
         doc_id_base = str(project_data.get('Intitulé', 'form')).replace(" ", "_").replace("/", "_")[:20]
         doc_id = f"{doc_id_base}_{datetime.now().strftime('%Y%m%d_%H%M')}_{submission_id[:6]}"
-        db.collection('FormAnswers').document(doc_id).set(final_document)
+
+        # Réponses et agrégats écrits dans le même batch (atomique)
+        db = get_db()
+        batch = db.batch()
+        batch.set(db.collection('FormAnswers').document(doc_id), final_document)
+        stats_updates = build_stats_updates(collected_data, project_data, start_time, final_document["submission_date"])
+        for stats_doc_id, stats_data in stats_updates.items():
+            batch.set(db.collection(STATS_COLLECTION).document(stats_doc_id), stats_data, merge=True)
+        with span('firestore.save_form_data'): batch.commit()
         return True, doc_id 
     except Exception as e:
         return False, str(e)
 
-def create_csv_export(collected_data, df_struct, project_name, submission_id, start_time):
-    data_for_df = []
+# --- STATISTIQUES AGRÉGÉES ---
+# Agrégats maintenus à chaque soumission : un document global, un par projet et un par section.
+# La lecture d'une statistique coûte une seule lecture de document, sans parcourir 'FormAnswers'.
+
+def _stats_key(name):
+    return str(name).strip().replace(" ", "_").replace("/", "_") or "N-A"
+
+def photo_gap_bucket(gap):
+    """Classe d'histogramme d'un écart de photos (reçu - attendu), bornée à ±PHOTO_GAP_BUCKET_LIMIT."""
+    if gap <= -PHOTO_GAP_BUCKET_LIMIT: return f"<=-{PHOTO_GAP_BUCKET_LIMIT}"
+    if gap >= PHOTO_GAP_BUCKET_LIMIT: return f">={PHOTO_GAP_BUCKET_LIMIT}"
+    return f"{gap:+d}" if gap else "0"
+
+def summarize_phase_photos(phase):
+    """Retourne (photos reçues, photos attendues ou None, commentaire requis) pour une phase validée.
+
+    Reprend le contrôle enregistré à la validation (phase_photo_check) : les statistiques comptent
+    exactement l'écart vu par l'inspecteur. Sans contrôle enregistré, seules les photos sont comptées.
+    """
+    answers = phase['answers']
+    check = phase.get('photo_check')
+    if check is None:
+        received = len({
+            photo_content_hash(f) for v in answers.values()
+            for f in (v if isinstance(v, list) else [v]) if hasattr(f, 'getvalue')
+        })
+        return received, None, False
+    # validate_section ne conserve le commentaire que si l'écart de photos l'a rendu obligatoire
+    comment_val = answers.get(COMMENT_ID)
+    comment_required = check['has_gap'] and comment_val is not None and str(comment_val).strip() != ""
+    return check['received'], check['expected'], comment_required
+
+def build_stats_updates(collected_data, project_data, start_time, submission_date):
+    """Construit les incréments Firestore (doc_id -> données à fusionner) pour une soumission."""
+    from firebase_admin import firestore
+    inc = firestore.Increment
+    sections = {}
     for phase in collected_data:
+        received, expected, comment_required = summarize_phase_photos(phase)
+        sec = sections.setdefault(str(phase['phase_name']).strip(), {
+            'phase_count': 0, 'photo_count': 0, 'photo_checked_count': 0,
+            'photo_gap_count': 0, 'comment_required_count': 0, 'photo_gap_hist': {},
+        })
+        sec['phase_count'] += 1
+        sec['photo_count'] += received
+        sec['comment_required_count'] += int(comment_required)
+        if expected is not None:
+            gap = received - expected
+            sec['photo_checked_count'] += 1
+            sec['photo_gap_count'] += int(gap != 0)
+            bucket = photo_gap_bucket(gap)
+            sec['photo_gap_hist'][bucket] = sec['photo_gap_hist'].get(bucket, 0) + 1
+
+    audit = {'audit_count': inc(1), 'last_submission_date': submission_date}
+    if start_time:
+        audit['duration_count'] = inc(1)
+        audit['duration_total_seconds'] = inc((submission_date - start_time).total_seconds())
+
+    def section_increments(sec):
+        data = {k: inc(v) for k, v in sec.items() if k != 'photo_gap_hist'}
+        data['photo_gap_hist'] = {b: inc(n) for b, n in sec['photo_gap_hist'].items()}
+        return data
+
+    totals = {}
+    for sec in sections.values():
+        for k, v in sec.items():
+            if k == 'photo_gap_hist':
+                hist = totals.setdefault(k, {})
+                for b, n in v.items(): hist[b] = hist.get(b, 0) + n
+            else:
+                totals[k] = totals.get(k, 0) + v
+    totals.setdefault('photo_gap_hist', {})
+
+    updates = {
+        STATS_GLOBAL_DOC: {**audit, **section_increments(totals)},
+        f"project_{_stats_key(project_data.get('Intitulé', 'N/A'))}": {
+            **audit, **section_increments(totals),
+            'project_intitule': project_data.get('Intitulé', 'N/A'),
+            'sections': {name: section_increments(sec) for name, sec in sections.items()},
+        },
+    }
+    for name, sec in sections.items():
+        updates[f"section_{_stats_key(name)}"] = {**audit, **section_increments(sec), 'section': name}
+    return updates
+
+@st.cache_data(ttl=300)
+def load_submission_stats(project_name=None, section_name=None):
+    """Lit un document d'agrégats (global, projet ou section) et ajoute la durée moyenne d'audit."""
+    if project_name is not None: doc_id = f"project_{_stats_key(project_name)}"
+    elif section_name is not None: doc_id = f"section_{_stats_key(section_name)}"
+    else: doc_id = STATS_GLOBAL_DOC
+    try:
+        with span('firestore.load_stats'):
+            snap = get_db().collection(STATS_COLLECTION).document(doc_id).get()
+        if not snap.exists: return None
+        stats = snap.to_dict()
+        n = stats.get('duration_count', 0)
+        stats['mean_duration_seconds'] = stats.get('duration_total_seconds', 0) / n if n else None
+        return stats
+    except Exception as e:
+        st.error(f"Erreur lors du chargement des statistiques: {e}")
+        return None
+
+# --- EXPORT CSV EN FLUX ---
+# Les lignes sont écrites directement par csv.writer, par blocs, sans DataFrame intermédiaire :
+# la mémoire reste constante quel que soit le nombre de soumissions exportées.
+
+CSV_COLUMNS = ['Submission_ID', 'Projet', 'Date_debut', 'Date_soumission', 'Phase', 'Question_ID', 'Question', 'Type', 'Réponse']
+CSV_CHUNK_SIZE = 64 * 1024
+
+def build_question_metadata(df_struct):
+    """Dictionnaire id de question -> (texte, type)."""
+    import pandas as pd
+    meta = {}
+    if df_struct is not None:
+        ids = pd.to_numeric(df_struct['id'], errors='coerce')
+        for i, q, t in zip(ids, df_struct['question'], df_struct['type']):
+            if not pd.isna(i): meta[int(i)] = (q, str(t).strip().lower())
+    meta[COMMENT_ID] = (COMMENT_QUESTION, 'text')
+    return meta
+
+def _csv_answer(answer):
+    if isinstance(answer, list):
+        names = [f.name for f in answer if hasattr(f, 'read')]
+        return f"Fichiers: {', '.join(names)}" if names else ""
+    if hasattr(answer, 'read'): return f"Fichier: {answer.name}"
+    return "" if answer is None else answer
+
+def _csv_date(value):
+    return value.isoformat(sep=' ', timespec='seconds') if hasattr(value, 'isoformat') else ("" if value is None else value)
+
+def iter_csv_rows(collected_phases, question_meta, project_name, submission_id, start_time, submission_date=None):
+    """Lignes CSV (selon CSV_COLUMNS) d'une soumission, en cours ou stockée."""
+    start_str, submission_str = _csv_date(start_time), _csv_date(submission_date)
+    for phase in collected_phases:
         for q_id, answer in phase['answers'].items():
-            if not hasattr(answer, 'read') and not (isinstance(answer, list) and answer and hasattr(answer[0], 'read')):
-                data_for_df.append({
-                    'Projet': project_name, 'Phase': phase['phase_name'],
-                    'Question_ID': q_id, 'Réponse': answer
-                })
-    return pd.DataFrame(data_for_df).to_csv(index=False).encode('utf-8')
+            try: q_text, q_type = question_meta.get(int(q_id), (f"ID {q_id}", ""))
+            except (TypeError, ValueError): q_text, q_type = f"ID {q_id}", ""
+            yield [submission_id, project_name, start_str, submission_str, phase['phase_name'], q_id, q_text, q_type, _csv_answer(answer)]
+
+def iter_csv_chunks(rows, header=True):
+    """Encode des lignes en blocs CSV UTF-8 d'environ CSV_CHUNK_SIZE octets."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header: writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CSV_CHUNK_SIZE:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+@timed('export.csv')
+def create_csv_export(collected_data, df_struct, project_name, submission_id, start_time):
+    """CSV de l'audit en cours (une ligne par réponse, avec texte et type de question)."""
+    rows = iter_csv_rows(collected_data, build_question_metadata(df_struct), project_name, submission_id, start_time, datetime.now())
+    return b''.join(iter_csv_chunks(rows))
+
+def iter_stored_submission_rows(documents, question_meta):
+    """Lignes CSV de soumissions 'FormAnswers' (instantanés Firestore ou dictionnaires), une à une."""
+    for document in documents:
+        data = document.to_dict() if hasattr(document, 'to_dict') else document
+        yield from iter_csv_rows(
+            data.get('collected_phases', []), question_meta, data.get('project_intitule', 'N/A'),
+            data.get('submission_id', ''), data.get('start_date'), data.get('submission_date'),
+        )
+
+@timed('export.csv_submissions')
+def export_submissions_csv(out, df_struct=None, project_name=None):
+    """Écrit dans le fichier binaire 'out' toutes les soumissions stockées (d'un projet si précisé).
 
+    Les documents sont lus en flux depuis Firestore : la mémoire utilisée ne dépend pas de leur nombre.
+    Retourne le nombre de soumissions exportées.
+    """
+    if df_struct is None: df_struct = load_form_structure_from_firestore()
+    query = get_db().collection('FormAnswers')
+    if project_name is not None: query = query.where('project_intitule', '==', project_name)
+
+    exported = 0
+    def counted(documents):
+        nonlocal exported
+        for document in documents:
+            exported += 1
+            yield document
+
+    rows = iter_stored_submission_rows(counted(query.stream()), build_question_metadata(df_struct))
+    for chunk in iter_csv_chunks(rows):
+        out.write(chunk)
+    return exported
+
+@timed('export.zip')
 def create_zip_export(collected_data):
     buf = io.BytesIO()
+    written = set()
     with zipfile.ZipFile(buf, 'w') as zip_file:
         for phase in collected_data:
             for q_id, files in phase['answers'].items():
                 photos = files if isinstance(files, list) else [files]
                 for i, f in enumerate(photos):
                     if hasattr(f, 'getvalue'):
-                        zip_file.writestr(f"{phase['phase_name']}_Q{q_id}_{i}.jpg", f.getvalue())
+                        # Chaque image distincte n'est écrite qu'une fois, sous le nom de sa première occurrence
+                        h = photo_content_hash(f)
+                        if h in written: continue
+                        written.add(h)
+                        zip_file.writestr(f"{phase['phase_name']}_Q{q_id}_{i}.jpg", photo_bytes(f))
     buf.seek(0)
     return buf
 
+# --- REVALIDATION GROUPÉE ---
+# Revalide des audits complets face à une version de la structure du formulaire (changement de
+# structure en cours de journée, retraitement des soumissions stockées). La structure est compilée
+# une fois en tableaux numpy, conditions OU/ET comprises ; chaque règle de validate_section est
+# ensuite évaluée pour toutes les phases de tous les audits en une seule passe matricielle.
+# Seule la lisibilité des images n'est pas revérifiée : 'FormAnswers' ne conserve que les noms de fichiers.
+
+REVALIDATION_COLUMNS = [
+    'Submission_ID', 'Projet', 'Phase_index', 'Phase', 'Question_ID', 'Question', 'Type', 'Obligatoire',
+    'Visible', 'Renseignee', 'Manquante', 'Photos_attendues', 'Photos_recues', 'Ecart_photos', 'Justification_manquante',
+]
+
+def _condition_enabled(value):
+    try: return int(value) == 1
+    except (ValueError, TypeError): return False
+
+def compile_form_structure(df_struct):
+    """Tableaux de la structure pour revalidate_audits, à réutiliser tant que la structure ne change pas.
+
+    Les conditions sont mises sous forme OU de ET : une matrice question x bloc et une matrice
+    bloc x atome, un atome étant (question cible, valeur attendue). Les valeurs attendues sont codées
+    en entiers pour comparer les réponses sans chaînes.
+    """
+    import numpy as np
+    rows = df_struct.to_dict('records')
+    atoms, atom_index, blocks, question_blocks = [], {}, [], []
+    conditional = np.zeros(len(rows), dtype=bool)
+    for i, row in enumerate(rows):
+        question_blocks.append([])
+        if not _condition_enabled(row.get('Condition on', 0)): continue
+        condition_raw = str(row.get('Condition value', '')).strip().strip('"').strip("'")
+        if not condition_raw: continue
+        conditional[i] = True
+        for block in condition_raw.split(' OU '):
+            members = []
+            for atom in block.split(' ET '):
+                # Atome illisible : toujours vrai, comme dans evaluate_single_condition
+                if '=' not in atom: continue
+                target_raw, expected_raw = atom.split('=', 1)
+                try: target = int(target_raw.strip())
+                except ValueError: continue
+                key = (target, expected_raw.strip().strip('"').strip("'").strip().lower())
+                if key not in atom_index:
+                    atom_index[key] = len(atoms)
+                    atoms.append(key)
+                members.append(atom_index[key])
+            question_blocks[i].append(len(blocks))
+            blocks.append(members)
+
+    block_atoms = np.zeros((len(blocks), len(atoms)), dtype=np.int32)
+    for b, members in enumerate(blocks): block_atoms[b, members] = 1
+    question_block_matrix = np.zeros((len(rows), len(blocks)), dtype=np.int32)
+    for i, members in enumerate(question_blocks): question_block_matrix[i, members] = 1
+
+    target_col = {t: k for k, t in enumerate(dict.fromkeys(t for t, _ in atoms))}
+    value_codes = {v: k for k, v in enumerate(dict.fromkeys(v for _, v in atoms))}
+    sections = [r['section'] for r in rows]
+    section_codes = {s: k for k, s in enumerate(dict.fromkeys(sections))}
+    types = np.array([str(r.get('type', '')).strip().lower() for r in rows], dtype=object)
+    ids = np.array([int(r['id']) for r in rows], dtype=np.int64)
+    return {
+        'ids': ids,
+        'id_index': {q_id: i for i, q_id in enumerate(ids.tolist())},
+        'questions': np.array([r.get('question', '') for r in rows], dtype=object),
+        'types': types,
+        'is_photo': types == 'photo',
+        'mandatory': np.array([str(r.get('obligatoire', '')).strip().lower() == 'oui' for r in rows], dtype=bool),
+        'section_codes': section_codes,
+        'section_of': np.array([section_codes[s] for s in sections], dtype=np.int64),
+        'conditional': conditional,
+        'target_col': target_col,
+        'value_codes': value_codes,
+        'atom_target_col': np.array([target_col[t] for t, _ in atoms], dtype=np.int64),
+        'atom_expected': np.array([value_codes[v] for _, v in atoms], dtype=np.int64),
+        'block_atoms': block_atoms,
+        'question_blocks': question_block_matrix,
+    }
+
+def _photo_keys(val):
+    """Photos d'une réponse : empreintes en session, noms pour une réponse stockée (« Fichiers: a, b »).
+
+    Retourne None si la réponse n'est pas une réponse photo.
+    """
+    if isinstance(val, list):
+        return [photo_content_hash(f) for f in val if hasattr(f, 'getvalue')]
+    if isinstance(val, str):
+        for prefix in ('Fichiers:', 'Fichier:'):
+            if val.startswith(prefix):
+                return [name.strip() for name in val[len(prefix):].split(',') if name.strip()]
+    return None
+
+@timed('revalidate_audits')
+def revalidate_audits(audits, df_struct=None, structure=None):
+    """Revalide des audits complets ; retourne un DataFrame (REVALIDATION_COLUMNS) d'une ligne par
+    question de chaque phase.
+
+    'audits' : soumissions 'FormAnswers' (instantanés Firestore ou dictionnaires avec 'collected_phases',
+    'project_details', 'project_intitule', 'submission_id'). Passer 'structure' (compile_form_structure)
+    évite de recompiler la structure d'un appel à l'autre.
+    """
+    import numpy as np
+    import pandas as pd
+    if structure is None: structure = compile_form_structure(df_struct)
+    id_index, target_col, value_codes = structure['id_index'], structure['target_col'], structure['value_codes']
+    is_photo, n_questions = structure['is_photo'], len(structure['ids'])
+
+    # 1. Une ligne par (audit, phase), réponses aux questions de condition cumulées depuis la 1re phase
+    row_audit, row_project, row_phase_index, row_phase, row_section = [], [], [], [], []
+    row_condition_codes, row_expected_base, row_justified = [], [], []
+    filled_rows, filled_cols = [], []
+    photo_rows, photo_cols, photo_keys = [], [], []
+    for audit in audits:
+        data = audit.to_dict() if hasattr(audit, 'to_dict') else audit
+        project_data = data.get('project_details') or {}
+        condition_codes = [-1] * len(target_col)
+        expected_by_phase = {}
+        for phase_index, phase in enumerate(data.get('collected_phases') or []):
+            r = len(row_audit)
+            phase_name = phase['phase_name']
+            answers = {}
+            for k, v in phase['answers'].items():
+                try: answers[int(k)] = v  # Clés en chaînes dans 'FormAnswers'
+                except (ValueError, TypeError): continue
+
+            for q_id, val in answers.items():
+                col = target_col.get(q_id)
+                if col is not None:
+                    condition_codes[col] = -1 if val is None else value_codes.get(str(val).strip().lower(), -2)
+                c = id_index.get(q_id)
+                if c is None: continue
+                if is_photo[c]:
+                    keys = _photo_keys(val) or []
+                    filled = len(val) > 0 if isinstance(val, list) else bool(keys)
+                    photo_rows.extend([r] * len(keys))
+                    photo_cols.extend([c] * len(keys))
+                    photo_keys.extend(keys)
+                elif isinstance(val, list):
+                    filled = bool(val)
+                else:
+                    filled = not (val is None or val == "" or (isinstance(val, (int, float)) and val == 0))
+                if filled:
+                    filled_rows.append(r)
+                    filled_cols.append(c)
+
+            if phase_name not in expected_by_phase:
+                expected_by_phase[phase_name] = get_expected_photo_count(str(phase_name).strip(), project_data)[0]
+            comment_val = answers.get(COMMENT_ID)
+            row_audit.append(data.get('submission_id', ''))
+            row_project.append(data.get('project_intitule', project_data.get('Intitulé', 'N/A')))
+            row_phase_index.append(phase_index)
+            row_phase.append(phase_name)
+            row_section.append(structure['section_codes'].get(phase_name, -1))
+            row_condition_codes.append(list(condition_codes))
+            row_expected_base.append(expected_by_phase[phase_name] or 0)
+            row_justified.append(comment_val is not None and str(comment_val).strip() != "")
+
+    n_rows = len(row_audit)
+    if not n_rows: return pd.DataFrame(columns=REVALIDATION_COLUMNS)
+
+    # 2. Visibilité : atomes -> blocs ET -> questions (OU), pour toutes les lignes à la fois
+    condition_codes = np.array(row_condition_codes, dtype=np.int64).reshape(n_rows, len(target_col))
+    atom_false = (condition_codes[:, structure['atom_target_col']] != structure['atom_expected']).astype(np.int32)
+    block_true = (atom_false @ structure['block_atoms'].T == 0).astype(np.int32)
+    visible = ~structure['conditional'] | (block_true @ structure['question_blocks'].T > 0)
+    in_section = np.array(row_section, dtype=np.int64)[:, None] == structure['section_of'][None, :]
+
+    filled = np.zeros((n_rows, n_questions), dtype=bool)
+    filled[filled_rows, filled_cols] = True
+    missing = in_section & visible & structure['mandatory'] & ~filled & (structure['ids'] != COMMENT_ID)
+
+    # 3. Photos : distinctes par phase parmi les questions photo visibles, attendu = base x questions visibles
+    visible_photo = in_section & visible & is_photo
+    photo_question_count = visible_photo.sum(axis=1)
+    received = np.zeros(n_rows, dtype=np.int64)
+    if photo_keys:
+        photo_rows, photo_cols = np.array(photo_rows, dtype=np.int64), np.array(photo_cols, dtype=np.int64)
+        key_codes, key_uniques = pd.factorize(pd.Series(photo_keys, dtype=object))
+        keep = visible_photo[photo_rows, photo_cols]
+        pairs = np.unique(photo_rows[keep] * len(key_uniques) + key_codes[keep])
+        received = np.bincount(pairs // len(key_uniques), minlength=n_rows)
+    expected_base = np.array(row_expected_base, dtype=np.int64)
+    expected = np.where(expected_base > 0, expected_base * photo_question_count, 0)
+    photo_gap = (expected > 0) & (photo_question_count > 0) & (received != expected)
+    justification_missing = photo_gap & ~np.array(row_justified, dtype=bool)
+
+    # 4. Table de résultats : une ligne par question de la section de chaque phase
+    r_idx, c_idx = np.nonzero(in_section)
+    return pd.DataFrame({
+        'Submission_ID': np.array(row_audit, dtype=object)[r_idx],
+        'Projet': np.array(row_project, dtype=object)[r_idx],
+        'Phase_index': np.array(row_phase_index, dtype=np.int64)[r_idx],
+        'Phase': np.array(row_phase, dtype=object)[r_idx],
+        'Question_ID': structure['ids'][c_idx],
+        'Question': structure['questions'][c_idx],
+        'Type': structure['types'][c_idx],
+        'Obligatoire': structure['mandatory'][c_idx],
+        'Visible': visible[r_idx, c_idx],
+        'Renseignee': filled[r_idx, c_idx],
+        'Manquante': missing[r_idx, c_idx],
+        'Photos_attendues': expected[r_idx],  # 0 : pas de règle pour la section
+        'Photos_recues': received[r_idx],
+        'Ecart_photos': photo_gap[r_idx],
+        'Justification_manquante': justification_missing[r_idx],
+    }, columns=REVALIDATION_COLUMNS)
+
+def revalidate_stored_submissions(df_struct=None, project_name=None):
+    """Revalide toutes les soumissions stockées (d'un projet si précisé) face à la structure donnée,
+    par défaut la structure actuelle."""
+    if df_struct is None: df_struct = load_form_structure_from_firestore()
+    query = get_db().collection('FormAnswers')
+    if project_name is not None: query = query.where('project_intitule', '==', project_name)
+    return revalidate_audits(query.stream(), structure=compile_form_structure(df_struct))
+
 # --- COMPOSANT UI ---
 def render_question(row, answers, phase_name, key_suffix, loop_index, project_data):
     q_id = int(row.get('id', 0))
@@ -447,5 +1854,7 @@ def render_question(row, answers, phase_name, key_suffix, loop_index, project_da
     elif q_type == 'photo':
         exp, det = get_expected_photo_count(phase_name.strip(), project_data)
         if exp: st.info(f"📸 **Attendu : {exp}** ({det})")
-        answers[q_id] = st.file_uploader("I", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key=widget_key, label_visibility="collapsed")
+        uploaded = st.file_uploader("I", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True, key=widget_key, label_visibility="collapsed")
+        answers[q_id] = get_photo_store().register(uploaded) if uploaded else uploaded
+        if uploaded: render_photo_previews(answers[q_id])
     st.markdown('</div>', unsafe_allow_html=True)